@@ -0,0 +1,429 @@
+import asyncio
+import logging
+import sys
+import time
+
+import serial
+
+from ModbusDevice import ModbusDevice
+from config_logger import config_logger
+from log_exception import log_exception
+
+
+class AsyncComPortBase:
+    """Common part of asyncio ports: receive buffer filled by event loop callbacks"""
+
+    def __init__(self, port: str, **kwargs):
+        self.port = port.strip()
+        self.kwargs = kwargs
+        self.logger = kwargs.pop('logger', config_logger())
+        self.lock = None
+        self.buffer = bytearray()
+        self.event = None
+        self.error = False
+        # number of devices using the port, see create_async_port and release_async_port
+        self.users = 0
+        # open in progress, awaited by all devices sharing the port
+        self.opening = None
+
+    def isOpen(self):
+        return False
+
+    async def open(self):
+        return False
+
+    async def ensure_open(self) -> bool:
+        if self.isOpen():
+            return True
+        if self.opening is None or self.opening.done():
+            self.opening = asyncio.ensure_future(self.open())
+        # cancelled caller does not cancel open for the others
+        return await asyncio.shield(self.opening)
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        self.event.set()
+
+    def reset_input_buffer(self):
+        self.buffer.clear()
+        return True
+
+    async def read_exact(self, n: int, deadline: float) -> bytes:
+        # wait until n bytes received or deadline (loop time) passes, returns available bytes
+        loop = asyncio.get_running_loop()
+        while len(self.buffer) < n and self.isOpen():
+            dt = deadline - loop.time()
+            if dt <= 0.0:
+                break
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), dt)
+            except asyncio.TimeoutError:
+                break
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+
+class AsyncMoxaTCPComPort(AsyncComPortBase):
+    """asyncio streams version of MoxaTCPComPort"""
+    DEFAULT_PORT = 4001
+    CREATE_TIMEOUT = 3.0
+
+    def __init__(self, host: str, port: int = None, **kwargs):
+        super().__init__(host, **kwargs)
+        if port is None:
+            port = AsyncMoxaTCPComPort.DEFAULT_PORT
+        if ':' in self.port:
+            n = self.port.find(':')
+            self.host = self.port[:n].strip()
+            try:
+                self.tcp_port = int(self.port[n + 1:].strip())
+            except:
+                self.tcp_port = int(port)
+        else:
+            self.host = self.port
+            self.tcp_port = int(port)
+        self.pre = f'MOXA {self.host}:{self.tcp_port}'
+        self.reader = None
+        self.writer = None
+        self.task = None
+
+    async def open(self):
+        if self.isOpen():
+            # live connection is never replaced
+            return True
+        await self.close()
+        self.error = False
+        self.lock = self.lock or asyncio.Lock()
+        self.event = self.event or asyncio.Event()
+        try:
+            create_timeout = self.kwargs.get('create_timeout', AsyncMoxaTCPComPort.CREATE_TIMEOUT)
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.tcp_port), create_timeout)
+            self.task = asyncio.ensure_future(self.read_loop(self.reader))
+            self.logger.debug(f'{self.pre} Connected')
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Connection exception')
+            self.reader = None
+            self.writer = None
+            self.error = True
+        return self.isOpen()
+
+    async def read_loop(self, reader):
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    self.logger.info(f'{self.pre} Connection closed by peer')
+                    break
+                self.feed(data)
+        except asyncio.CancelledError:
+            return
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Read error')
+        if self.reader is not reader:
+            # connection has been replaced
+            return
+        self.error = True
+        self.writer = None
+        self.event.set()
+
+    def isOpen(self):
+        return self.writer is not None
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.writer is None:
+            return True
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Close exception')
+        self.writer = None
+        self.reader = None
+        return True
+
+    async def write(self, data: bytes) -> int:
+        if not self.isOpen():
+            return 0
+        self.writer.write(data)
+        await self.writer.drain()
+        return len(data)
+
+
+class AsyncSerialComPort(AsyncComPortBase):
+    """Serial port driven by event loop reader callback on non-blocking descriptor (posix only)"""
+
+    def __init__(self, port: str, *args, **kwargs):
+        super().__init__(port, **kwargs)
+        self.args = args
+        self.kwargs['timeout'] = 0.0
+        self.pre = f'{self.port}'
+        self.device = None
+        self.loop = None
+
+    async def open(self):
+        if self.isOpen():
+            # live port is never replaced
+            return True
+        await self.close()
+        self.error = False
+        self.lock = self.lock or asyncio.Lock()
+        self.event = self.event or asyncio.Event()
+        try:
+            self.device = serial.Serial(self.port, *self.args, **self.kwargs)
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(self.device.fileno(), self.on_readable)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Open exception')
+            self.device = None
+            self.error = True
+        return self.isOpen()
+
+    def on_readable(self):
+        try:
+            data = self.device.read(max(self.device.in_waiting, 1))
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Read error')
+            self.loop.remove_reader(self.device.fileno())
+            self.error = True
+            self.event.set()
+            return
+        if data:
+            self.feed(data)
+
+    def isOpen(self):
+        return self.device is not None and self.device.isOpen() and not self.error
+
+    async def close(self):
+        if self.device is None:
+            return True
+        try:
+            if self.loop is not None:
+                self.loop.remove_reader(self.device.fileno())
+            self.device.close()
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Close exception')
+        self.device = None
+        return True
+
+    async def write(self, data: bytes) -> int:
+        if not self.isOpen():
+            return 0
+        return self.device.write(data)
+
+
+_ports = {}
+
+
+async def create_async_port(port: str, *args, **kwargs):
+    # ports are shared by devices, one instance per port name
+    port = port.strip()
+    if port.upper().startswith('COM'):
+        port = port.upper()
+    p = _ports.get(port)
+    if p is None:
+        if port.startswith(('COM', 'tty', '/dev', 'cua')):
+            p = AsyncSerialComPort(port, *args, **kwargs)
+        else:
+            kwargs.pop('baudrate', None)
+            kwargs.pop('parity', None)
+            p = AsyncMoxaTCPComPort(port, *args, **kwargs)
+        _ports[port] = p
+    p.users += 1
+    await p.ensure_open()
+    return p
+
+
+async def release_async_port(p):
+    # port is closed when the last device using it is closed
+    p.users -= 1
+    if p.users > 0:
+        return False
+    p.users = 0
+    if _ports.get(p.port) is p:
+        del _ports[p.port]
+    return await p.close()
+
+
+class AsyncModbusDevice:
+    """asyncio version of ModbusDevice with the same modbus_read/modbus_write semantics and error codes"""
+    SUSPEND_DELAY = ModbusDevice.SUSPEND_DELAY
+    READ_TIMEOUT = ModbusDevice.READ_TIMEOUT
+
+    # frame checks shared with ModbusDevice
+    checksum = staticmethod(ModbusDevice.checksum)
+    add_checksum = ModbusDevice.add_checksum
+    verify_checksum = ModbusDevice.verify_checksum
+    check_response = ModbusDevice.check_response
+    debug = ModbusDevice.debug
+    info = ModbusDevice.info
+    warning = ModbusDevice.warning
+
+    def __init__(self, port: str, addr: int, **kwargs):
+        self.port = str(port).strip()
+        self.addr = int(addr)
+        self.com = None
+        # serializes build, send and decode of device transactions, created in event loop
+        self.lock = None
+        self.id = 'Async Modbus device'
+        self.error = 0
+        self.command = 0
+        self.request = b''
+        self.response = b''
+        self.suspend_to = 0.0
+        self.read_timeout = kwargs.pop('read_timeout', AsyncModbusDevice.READ_TIMEOUT)
+        self.suspend_delay = kwargs.pop('suspend_delay', AsyncModbusDevice.SUSPEND_DELAY)
+        self.logger = kwargs.get('logger', config_logger(level=logging.DEBUG))
+        self.pre = f'{self.id} at {self.port}: {self.addr} '
+        if 'baudrate' not in kwargs:
+            kwargs['baudrate'] = 115200
+        self.kwargs = kwargs
+
+    async def open(self):
+        self.lock = self.lock or asyncio.Lock()
+        if self.com is None:
+            self.com = await create_async_port(self.port, **dict(self.kwargs))
+        else:
+            await self.com.ensure_open()
+        if not self.com.isOpen():
+            self.info('COM port not ready')
+            self.suspend()
+            return False
+        self.suspend_to = 0.0
+        return True
+
+    async def close(self):
+        if self.com is not None:
+            com = self.com
+            self.com = None
+            await release_async_port(com)
+
+    def suspend(self, duration=None):
+        if time.time() < self.suspend_to:
+            return
+        if duration is None:
+            duration = self.suspend_delay
+        self.suspend_to = time.time() + duration
+        self.debug('suspended for %5.2f sec', duration)
+
+    async def ready(self) -> bool:
+        if time.time() < self.suspend_to:
+            return False
+        if self.com is None or not self.com.isOpen():
+            return await self.open()
+        return True
+
+    async def transact(self, msg) -> bool:
+        if not await self.ready():
+            self.error = 262
+            return False
+        async with self.com.lock:
+            self.error = 0
+            self.com.reset_input_buffer()
+            self.request = self.add_checksum(msg)
+            n = await self.com.write(self.request)
+            if n != len(self.request):
+                self.error = 263
+                self.suspend()
+                return False
+            return await self.receive()
+
+    async def receive(self, extra_bytes=5) -> bool:
+        deadline = asyncio.get_running_loop().time() + self.read_timeout
+        self.response = await self.com.read_exact(3, deadline)
+        if len(self.response) < 3:
+            self.error = 259
+            self.suspend()
+            return False
+        if self.response[0] != self.addr:
+            self.error = 260
+            return False
+        op = self.response[1]
+        if op != self.command and op != (self.command + 128):
+            self.error = 261
+            self.logger.error(f'OP code != self.command {self.response} {self.command}')
+            return False
+        if op > 128:
+            k = 5
+        elif 4 < op < 17:
+            k = 8
+        else:
+            k = self.response[2] + extra_bytes
+        self.response += await self.com.read_exact(k - 3, deadline)
+        if len(self.response) < k:
+            self.error = 259
+            self.suspend()
+            return False
+        return self.check_response(self.response)
+
+    async def modbus_read(self, start: int, length: int = 1, address=None, command=3):
+        self.lock = self.lock or asyncio.Lock()
+        async with self.lock:
+            self.command = command
+            if address is None:
+                address = self.addr
+            msg = bytes((address, command)) + start.to_bytes(2, 'big') + length.to_bytes(2, 'big')
+            data = []
+            if not await self.transact(msg):
+                return data
+            for i in range(length):
+                data.append(int.from_bytes(self.response[2 * i + 3:2 * i + 5], byteorder='big'))
+            return data
+
+    async def modbus_write(self, start: int, data, address=None, command=16) -> int:
+        if isinstance(data, int):
+            data = [data, ]
+        try:
+            if len(data) <= 0:
+                return 0
+        except:
+            return 0
+        if address is None:
+            address = self.addr
+        out = bytearray()
+        for d in data:
+            if isinstance(d, int):
+                out += d.to_bytes(2, byteorder='big')
+            elif isinstance(d, bytes):
+                out += d
+            else:
+                self.logger.error('Wrong data format for write')
+                return 0
+        length = len(out)
+        msg = bytes((address, command)) + start.to_bytes(2, 'big') + (length // 2).to_bytes(2, 'big')
+        msg += length.to_bytes(1, 'big') + out
+        self.lock = self.lock or asyncio.Lock()
+        async with self.lock:
+            self.command = command
+            if not await self.transact(msg):
+                return 0
+            return int.from_bytes(self.response[4:6], byteorder='big')
+
+
+if __name__ == "__main__":
+    async def main():
+        devices = [AsyncModbusDevice(sys.argv[1] if len(sys.argv) > 1 else '192.168.1.204', a) for a in range(1, 9)]
+        for d in devices:
+            await d.open()
+        t_0 = time.time()
+        result = await asyncio.gather(*[d.modbus_read(4096, 18) for d in devices])
+        print(result, [d.error for d in devices], '%4d ms' % int((time.time() - t_0) * 1000.0))
+
+    asyncio.run(main())
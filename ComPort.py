@@ -1,3 +1,4 @@
+import collections
 import logging
 import os
 import sys
@@ -7,20 +8,45 @@ from serial import SerialException
 if os.path.realpath('../TangoUtils') not in sys.path: sys.path.append(os.path.realpath('../TangoUtils'))
 
 import inspect
+import select
 import time
 
 import serial
 import serial.tools.list_ports
-from threading import RLock, Lock
+from threading import RLock, Lock, Condition, Thread
 
+from ComPortCapture import ComPortRecorder
+from ModbusBus import ModbusBus
+from ModbusMetrics import ModbusMetrics
+from ModbusTCP import ModbusTCPComPort, PREFIX as MBTCP_PREFIX
 from Moxa import MoxaTCPComPort
+from Reconnector import Reconnector
 from config_logger import config_logger
 from log_exception import log_exception
 
+# port states, reopen of suspended port runs in Reconnector thread
+OPEN = 'OPEN'
+SUSPENDED = 'SUSPENDED'
+REOPENING = 'REOPENING'
+# closed by the last user, reopened by the next ComPort() call only
+FAILED = 'FAILED'
+
 
 class ComPort:
     _ports = {}
     _lock = Lock()
+    POLL_INTERVAL = 0.001
+    # background reader buffer size, the oldest bytes are dropped on overflow
+    READER_BUFFER = 65536
+    # reusable receive buffer for readinto callers
+    RECEIVE_BUFFER = 4096
+    # serial port enumeration cache, refreshed after TTL or on /dev change
+    PORT_LIST_TTL = 10.0
+    PORT_LIST_MIN_AGE = 0.5
+    _port_list = None
+    _port_list_time = 0.0
+    _port_list_mtime = None
+    _port_list_lock = Lock()
 
     def __new__(cls, port: str, *args, **kwargs):
         port = port.strip()
@@ -50,6 +76,13 @@ class ComPort:
             p.open_counter += 1
             if not p.device.isOpen():
                 p.device.open()
+            if p.state == FAILED:
+                if p.device.isOpen():
+                    p.state = OPEN
+                else:
+                    p.suspend()
+            if kwargs.get('reader', p.reader):
+                p.start_reader()
             for i in range(10):
                 time.sleep(0.05)
                 # p.logger.debug(f'{p.port} Ready: {p.ready}')
@@ -65,6 +98,20 @@ class ComPort:
         self.logger = kwargs.pop('logger', config_logger())
         self.emulated = kwargs.pop('emulated', None)
         self.suspend_delay = kwargs.pop('suspend_delay', 5.0)
+        # background thread drains device to ring buffer, reads are served from memory
+        self.reader = kwargs.pop('reader', False)
+        self.reader_buffer = kwargs.pop('reader_buffer', ComPort.READER_BUFFER)
+        # capture file name, port traffic is recorded by ComPortRecorder
+        self.record = kwargs.pop('record', None)
+        self.reader_thread = None
+        self.rx_condition = Condition()
+        self.rx_data = bytearray()
+        # (absolute end position, arrival time) of received chunks, rx_base is absolute position of rx_data[0]
+        self.rx_stamps = collections.deque()
+        self.rx_base = 0
+        self.rx_dropped = 0
+        self.receive_buffer = bytearray(ComPort.RECEIVE_BUFFER)
+        self.receive_view = memoryview(self.receive_buffer)
         self.args = args
         self.kwargs = kwargs
         self.lock = RLock()
@@ -72,12 +119,17 @@ class ComPort:
         self.current_addr = -1  # current address for RS485 devices
         self.used_addr = []  # used addresses list for RS485 devices
         self.suspend_to = 0.0
+        self.state = OPEN
         self.device = None
+        self._bus = None
+        self._metrics = None
         # create new port and add it to list
         self.create_port()
         self.open_counter = 1
         with ComPort._lock:
             ComPort._ports[self.port] = self
+        if self.reader:
+            self.start_reader()
         if self.ready:
             self.logger.debug(f'{self.port} has been initialized')
         else:
@@ -87,46 +139,79 @@ class ComPort:
         self.close()
 
     def create_port(self):
+        # slow device creation and open are done without port lock
+        device = self.new_device()
         with self.lock:
-            # self.open_counter = 1
             self.suspend_to = 0.0
-            try:
-                # create port device
-                if self.port.startswith('FAKE') or self.port.startswith('EMULATED'):
-                    if self.emulated is None:
-                        self.logger.info(f'{self.port} Emulated port class is not defined')
-                        self.device = EmptyComPort()
-                    self.device = self.emulated(self.port, *self.args, **self.kwargs)
-                elif (self.port.startswith('COM')
-                      or self.port.startswith('tty')
-                      or self.port.startswith('/dev')
-                      or self.port.startswith('cua')):
-                    if 'timeout' not in self.kwargs:
-                        self.kwargs['timeout'] = 0.0
-                    if 'write_timeout' not in self.kwargs:
-                        self.kwargs['write_timeout'] = 0.0
-                    ports = serial.tools.list_ports.comports()
-                    self.device = None
-                    for p in ports:
-                        if p.device == self.port:
-                            self.device = serial.Serial(self.port, *self.args, **self.kwargs)
-                            break
-                    if self.device is None:
-                        self.logger.info('%s port does not exist', self.port)
-                        self.device = EmptyComPort()
-                else:
-                    self.kwargs['logger'] = self.logger
-                    self.device = MoxaTCPComPort(self.port, *self.args, **self.kwargs)
-            except KeyboardInterrupt:
-                raise
-            except:
-                log_exception(self.logger, f'{self.port} Error creating port, using EmptyComPort')
-                self.device = EmptyComPort()
-            if not self.device.isOpen():
-                self.device.open()
+            self.state = OPEN
+            self.device = device
             if not self.device.isOpen():
                 self.suspend()
 
+    def new_device(self):
+        device = None
+        try:
+            # create port device
+            if self.port.startswith('FAKE') or self.port.startswith('EMULATED'):
+                if self.emulated is None:
+                    self.logger.info(f'{self.port} Emulated port class is not defined')
+                    device = EmptyComPort()
+                device = self.emulated(self.port, *self.args, **self.kwargs)
+            elif (self.port.startswith('COM')
+                  or self.port.startswith('tty')
+                  or self.port.startswith('/dev')
+                  or self.port.startswith('cua')):
+                if 'timeout' not in self.kwargs:
+                    self.kwargs['timeout'] = 0.0
+                if 'write_timeout' not in self.kwargs:
+                    self.kwargs['write_timeout'] = 0.0
+                if self.port.startswith('/dev/'):
+                    # explicit device path is opened directly, pseudo terminals are not listed by comports()
+                    exists = os.path.exists(self.port)
+                else:
+                    # missing port may be just plugged in, recheck with fresh list
+                    exists = (self.port in ComPort.list_ports()
+                              or self.port in ComPort.list_ports(ComPort.PORT_LIST_MIN_AGE))
+                if exists:
+                    device = serial.Serial(self.port, *self.args, **self.kwargs)
+                if device is None:
+                    self.logger.info('%s port does not exist', self.port)
+                    device = EmptyComPort()
+            elif self.port.lower().startswith(MBTCP_PREFIX):
+                self.kwargs['logger'] = self.logger
+                device = ModbusTCPComPort(self.port, *self.args, **self.kwargs)
+            else:
+                self.kwargs['logger'] = self.logger
+                device = MoxaTCPComPort(self.port, *self.args, **self.kwargs)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.port} Error creating port, using EmptyComPort')
+            device = EmptyComPort()
+        if self.record and not isinstance(device, (EmptyComPort, ModbusTCPComPort)):
+            device = ComPortRecorder(device, self.record)
+        if not device.isOpen():
+            device.open()
+        return device
+
+    @staticmethod
+    def list_ports(max_age: float = None) -> set:
+        # device names from serial.tools.list_ports.comports(), cached for max_age
+        # or until /dev is changed by plugged or removed device
+        if max_age is None:
+            max_age = ComPort.PORT_LIST_TTL
+        try:
+            mtime = os.stat('/dev').st_mtime
+        except OSError:
+            mtime = None
+        with ComPort._port_list_lock:
+            if (ComPort._port_list is None or mtime != ComPort._port_list_mtime
+                    or time.time() - ComPort._port_list_time > max_age):
+                ComPort._port_list = {p.device for p in serial.tools.list_ports.comports()}
+                ComPort._port_list_time = time.time()
+                ComPort._port_list_mtime = mtime
+            return ComPort._port_list
+
     def close(self):
         try:
             with self.lock:
@@ -135,6 +220,8 @@ class ComPort:
                 self.open_counter -= 1
                 if self.open_counter <= 0:
                     self.open_counter = 0
+                    self.stop_reader()
+                    self.state = FAILED
                     if self.device.isOpen():
                         self.device.close()
                         if self.device.isOpen():
@@ -148,7 +235,142 @@ class ComPort:
             log_exception(self.logger, f'{self.port} Port close exception')
             return False
 
+    @property
+    def raw_device(self):
+        return raw_device(self.device)
+
+    def start_reader(self):
+        with self.rx_condition:
+            self.reader = True
+            if self.reader_thread is not None and self.reader_thread.is_alive():
+                return
+            if isinstance(self.raw_device, ModbusTCPComPort):
+                # transport has own reader matching transactions
+                return
+            self.reader_thread = Thread(target=self.read_loop, name=f'ComPort reader {self.port}', daemon=True)
+            self.reader_thread.start()
+
+    def stop_reader(self):
+        with self.rx_condition:
+            thread = self.reader_thread
+            self.reader_thread = None
+            self.rx_condition.notify_all()
+        if thread is not None and thread.is_alive():
+            thread.join(1.0)
+
+    @property
+    def reader_active(self):
+        return self.reader_thread is not None
+
+    def read_loop(self):
+        # runs in reader thread, does not take port lock, so it feeds transactions holding it
+        me = self.reader_thread
+        while self.reader_thread is me:
+            device = self.device
+            if self.state != OPEN or isinstance(device, EmptyComPort):
+                time.sleep(0.1)
+                continue
+            try:
+                readable = self.wait_device(0.1)
+                data = device.read(4096)
+            except KeyboardInterrupt:
+                raise
+            except:
+                if self.reader_thread is me and device is self.device:
+                    log_exception(self.logger, f'{self.port} Reader exception')
+                    self.suspend()
+                continue
+            if not data:
+                if readable is True and isinstance(raw_device(device), MoxaTCPComPort):
+                    # readable socket without data is closed by peer
+                    self.suspend()
+                continue
+            now = time.time()
+            with self.rx_condition:
+                self.rx_data += data
+                self.rx_stamps.append((self.rx_base + len(self.rx_data), now))
+                n = len(self.rx_data) - self.reader_buffer
+                if n > 0:
+                    self.consume(n)
+                    self.rx_dropped += n
+                self.rx_condition.notify_all()
+
+    def consume(self, n: int) -> bytes:
+        # called with rx_condition locked, removes n bytes from ring buffer
+        data = bytes(self.rx_data[:n])
+        self.drop(n)
+        return data
+
+    def drop(self, n: int):
+        # called with rx_condition locked
+        del self.rx_data[:n]
+        self.rx_base += n
+        while self.rx_stamps and self.rx_stamps[0][0] <= self.rx_base:
+            self.rx_stamps.popleft()
+
+    def arrival_time(self, pos: int = 0) -> float:
+        # arrival time of buffered byte at pos, 0.0 if not buffered
+        with self.rx_condition:
+            if pos >= len(self.rx_data):
+                return 0.0
+            for end, t in self.rx_stamps:
+                if end > self.rx_base + pos:
+                    return t
+            return 0.0
+
+    def read_exact(self, n: int, deadline: float = None) -> bytes:
+        # n bytes, or less if deadline (time.time()) expires
+        if not self.reader_active:
+            result = b''
+            while len(result) < n:
+                result += self.read(n - len(result)) or b''
+                dt = 0.0 if deadline is None else deadline - time.time()
+                if len(result) >= n or (deadline is not None and dt <= 0.0):
+                    break
+                self.wait_readable(dt if deadline is not None else 0.1)
+            return result
+        with self.rx_condition:
+            while len(self.rx_data) < n and self.reader_active:
+                dt = None if deadline is None else deadline - time.time()
+                if dt is not None and dt <= 0.0:
+                    break
+                self.rx_condition.wait(dt)
+            return self.consume(min(n, len(self.rx_data)))
+
+    def read_until(self, terminator=b'\n', deadline: float = None, size: int = None) -> bytes:
+        # bytes up to and including terminator, received bytes if deadline expires or size is reached
+        terminator = bytes(terminator)
+        if not self.reader_active:
+            result = b''
+            while True:
+                data = self.read(1) or b''
+                result += data
+                if result.endswith(terminator) or (size is not None and len(result) >= size):
+                    return result
+                if not data:
+                    if deadline is not None and time.time() >= deadline:
+                        return result
+                    self.wait_readable(0.1 if deadline is None else deadline - time.time())
+        with self.rx_condition:
+            start = 0
+            while True:
+                k = self.rx_data.find(terminator, start)
+                if k >= 0:
+                    return self.consume(k + len(terminator) if size is None else min(k + len(terminator), size))
+                if size is not None and len(self.rx_data) >= size:
+                    return self.consume(size)
+                start = max(len(self.rx_data) - len(terminator) + 1, 0)
+                dt = None if deadline is None else deadline - time.time()
+                if (dt is not None and dt <= 0.0) or not self.reader_active:
+                    return self.consume(len(self.rx_data))
+                self.rx_condition.wait(dt)
+
     def read(self, *args, **kwargs):
+        if self.reader_active:
+            # served from reader buffer
+            n = args[0] if args else kwargs.get('size', 1)
+            with self.rx_condition:
+                return self.consume(min(n, len(self.rx_data)))
         try:
             with self.lock:
                 if self.ready:
@@ -161,6 +383,27 @@ class ComPort:
             log_exception(self.logger, f'{self.port} Read exception')
             self.suspend()
 
+    def readinto(self, buffer) -> int:
+        # fill writable buffer with available input, returns number of bytes
+        if self.reader_active:
+            with self.rx_condition:
+                n = min(len(buffer), len(self.rx_data))
+                if n > 0:
+                    buffer[:n] = memoryview(self.rx_data)[:n]
+                    self.drop(n)
+                return n
+        try:
+            with self.lock:
+                if self.ready:
+                    return device_readinto(self.device, buffer)
+                return 0
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.port} Read exception')
+            self.suspend()
+            return 0
+
     def write(self, *args, **kwargs):
         try:
             with self.lock:
@@ -177,7 +420,42 @@ class ComPort:
             log_exception(self.logger, f'{self.port} Write exception')
             self.suspend()
 
+    def wait_readable(self, timeout):
+        # block until input is available or timeout expires, returns True if input may be available.
+        # does not take port lock, ports without selectable descriptor fall back to short sleep
+        if self.reader_active:
+            with self.rx_condition:
+                if not self.rx_data:
+                    self.rx_condition.wait(max(timeout, 0.0))
+                return len(self.rx_data) > 0
+        return self.wait_device(timeout)
+
+    def wait_device(self, timeout):
+        wait = getattr(self.device, 'wait_readable', None)
+        if wait is not None:
+            return wait(timeout)
+        try:
+            fd = self.device.fileno()
+        except KeyboardInterrupt:
+            raise
+        except:
+            fd = None
+        if fd is None or (sys.platform.startswith('win') and not isinstance(self.raw_device, MoxaTCPComPort)):
+            time.sleep(min(timeout, self.POLL_INTERVAL))
+            return True
+        try:
+            r, w, x = select.select([fd], [], [], max(timeout, 0.0))
+            return len(r) > 0
+        except KeyboardInterrupt:
+            raise
+        except:
+            time.sleep(min(timeout, self.POLL_INTERVAL))
+            return True
+
     def reset_input_buffer(self):
+        if self.reader_active:
+            with self.rx_condition:
+                self.consume(len(self.rx_data))
         with self.lock:
             if self.ready:
                 try:
@@ -207,43 +485,77 @@ class ComPort:
 
     @property
     def ready(self):
-        with self.lock:
-            if time.time() < self.suspend_to:
-                # self.logger.debug(f'{self.port} operations suspended')
-                return False
-            if self.suspend_to <= 0.0:
-                return True
+        # single attribute check for open port, I/O callers are never blocked by reopen
+        if self.state == OPEN:
+            return True
+        if self.state == SUSPENDED and time.time() >= self.suspend_to:
             # suspension expires
-            self.suspend_to = 0.0
-            # if self.device.isOpen():
-            #     return True
-            try:
-                if isinstance(self.device, EmptyComPort):
-                    self.create_port()
-                else:
-                    self.device.close()
-                    self.device.open()
-                if self.device.isOpen():
+            self.state = REOPENING
+            Reconnector.instance().schedule(self.reopen, key=self)
+        return False
+
+    def reopen(self):
+        # runs in Reconnector thread, device is opened without port lock and swapped in under it,
+        # I/O callers see REOPENING state and return at once
+        if self.state != REOPENING:
+            return False
+        self.suspend_to = 0.0
+        try:
+            device = self.device
+            if isinstance(device, EmptyComPort):
+                device = self.new_device()
+            else:
+                device.close()
+                device.open()
+            with self.lock:
+                if self.state != REOPENING:
+                    # port has been closed meanwhile
+                    if device is not self.device:
+                        device.close()
+                    return False
+                self.device = device
+                if device.isOpen():
+                    self.state = OPEN
                     self.logger.debug(f'{self.port} reopened')
                     return True
                 self.suspend()
-                self.logger.debug(f'{self.port} reopen failed')
-                return False
-            except KeyboardInterrupt:
-                raise
-            except:
-                log_exception(self.logger, f'{self.port} reopen exception')
+            self.logger.debug(f'{self.port} reopen failed')
+            return False
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.port} reopen exception')
+            with self.lock:
                 self.suspend()
-                return False
+            return False
 
     def suspend(self):
-        if self.suspend_to > 0.0:
+        if self.state == SUSPENDED or self.state == FAILED:
             return
         self.suspend_to = time.time() + self.suspend_delay
+        self.state = SUSPENDED
         self.logger.debug(f'{self.port} Suspended for {self.suspend_delay} s')
 
+    @property
+    def bus(self):
+        # Modbus transaction scheduler for devices on this port, created on first use
+        with self.lock:
+            if self._bus is None:
+                self._bus = ModbusBus(self, logger=self.logger)
+            return self._bus
+
+    @property
+    def metrics(self):
+        # transaction metrics of all devices on this port, created on first use
+        with self.lock:
+            if self._metrics is None:
+                self._metrics = ModbusMetrics(self.port)
+            return self._metrics
+
     @property
     def in_waiting(self):
+        if self.reader_active:
+            return len(self.rx_data)
         with self.lock:
             if self.ready:
                 try:
@@ -256,6 +568,28 @@ class ComPort:
                 return 0
 
 
+def raw_device(device):
+    # port device behind capture recorder
+    if isinstance(device, ComPortRecorder):
+        return device.device
+    return device
+
+
+def device_readinto(device, buffer) -> int:
+    # serial ports are read by os.readv on non blocking descriptor, sockets by recv_into
+    if isinstance(device, serial.Serial) and hasattr(os, 'readv') and getattr(device, 'fd', None) is not None:
+        try:
+            return os.readv(device.fd, [buffer])
+        except BlockingIOError:
+            return 0
+    readinto = getattr(device, 'readinto', None)
+    if readinto is not None:
+        return readinto(buffer) or 0
+    data = device.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+
 class EmptyComPort:
     """Reads nothing, writes 0 bytes"""
 
@@ -288,6 +622,9 @@ class EmptyComPort:
     def read(self, *args, **kwargs):
         return b''
 
+    def readinto(self, buffer):
+        return 0
+
     @property
     def ready(self):
         return self.rdy
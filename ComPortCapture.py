@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Record and replay of ComPort traffic.
+ComPortRecorder wraps port device and stores writes and reads with arrival times to binary capture file,
+ComPortReplay is used as ComPort emulated class and reproduces recorded responses with recorded timing:
+    ComPort('COM3', record='session.cap')
+    ComPort('EMULATED-COM3', emulated=ComPortReplay, capture='session.cap')
+Capture summary:
+    python ComPortCapture.py session.cap
+"""
+import struct
+import sys
+import time
+from collections import deque
+from threading import RLock, Condition
+
+from config_logger import config_logger
+
+MAGIC = b'CPCAP1\n'
+# record: kind, time, payload length
+RECORD = struct.Struct('<cdI')
+WRITE = b'W'
+READ = b'R'
+
+
+def read_capture(file_name: str) -> list:
+    # list of (kind, time, data)
+    records = []
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{file_name} is not a port capture file')
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            kind, t, n = RECORD.unpack(header)
+            data = f.read(n)
+            if len(data) < n:
+                break
+            records.append((kind, t, data))
+    return records
+
+
+class ComPortRecorder:
+    """Port device wrapper logging writes and non empty reads to capture file"""
+
+    def __init__(self, device, file_name: str):
+        self.device = device
+        self.file_name = file_name
+        self.lock = RLock()
+        self.file = None
+        self.records = 0
+        self.open_file()
+
+    def __getattr__(self, name):
+        # everything else is served by wrapped device
+        return getattr(self.__dict__['device'], name)
+
+    def open_file(self):
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.file_name, 'ab')
+                if self.file.tell() == 0:
+                    self.file.write(MAGIC)
+
+    def record(self, kind: bytes, data):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(kind, time.time(), len(data)))
+            self.file.write(data)
+            # capture survives crash of recording process
+            self.file.flush()
+            self.records += 1
+
+    def write(self, data, *args, **kwargs):
+        n = self.device.write(data, *args, **kwargs)
+        if n:
+            self.record(WRITE, memoryview(data)[:n])
+        return n
+
+    def read(self, *args, **kwargs):
+        data = self.device.read(*args, **kwargs)
+        if data:
+            self.record(READ, data)
+        return data
+
+    def readinto(self, buffer, *args, **kwargs):
+        readinto = getattr(self.device, 'readinto', None)
+        if readinto is not None:
+            n = readinto(buffer, *args, **kwargs) or 0
+        else:
+            data = self.device.read(len(buffer))
+            n = len(data)
+            buffer[:n] = data
+        if n > 0:
+            self.record(READ, memoryview(buffer)[:n])
+        return n
+
+    def open(self):
+        self.open_file()
+        return self.device.open()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        return self.device.close()
+
+
+class ComPortReplay:
+    """Replays capture file as emulated port.
+
+    Each write consumes the next recorded write, reads recorded after it become readable
+    with recorded delays from the write divided by speed. Written data differing from
+    recorded are counted in mismatches.
+    """
+    SPEED = 1.0
+
+    def __init__(self, port: str, *args, **kwargs):
+        self.port = port
+        self.logger = kwargs.get('logger', config_logger())
+        self.file_name = kwargs['capture']
+        self.speed = kwargs.get('speed', ComPortReplay.SPEED)
+        self.records = read_capture(self.file_name)
+        self.position = 0
+        self.mismatches = 0
+        # (release time, data)
+        self.tx = deque()
+        self.rx = bytearray()
+        self.condition = Condition()
+        self.opened = True
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.records) and not self.tx and not self.rx
+
+    def open(self):
+        self.opened = True
+        return True
+
+    def isOpen(self):
+        return self.opened
+
+    def close(self):
+        self.opened = False
+        return True
+
+    @property
+    def ready(self):
+        return self.opened
+
+    def rewind(self):
+        with self.condition:
+            self.position = 0
+            self.tx.clear()
+            self.rx.clear()
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.release()
+            self.tx.clear()
+            self.rx.clear()
+        return True
+
+    def reset_output_buffer(self):
+        return True
+
+    def write(self, data, *args, **kwargs):
+        now = time.perf_counter()
+        data = bytes(data)
+        with self.condition:
+            # skip reads not requested by previous writes
+            while self.position < len(self.records) and self.records[self.position][0] != WRITE:
+                self.position += 1
+            if self.position >= len(self.records):
+                self.logger.debug(f'{self.port} End of capture')
+                return len(data)
+            kind, t_0, recorded = self.records[self.position]
+            self.position += 1
+            if recorded != data:
+                self.mismatches += 1
+                self.logger.debug(f'{self.port} Written {data} differs from recorded {recorded}')
+            while self.position < len(self.records) and self.records[self.position][0] == READ:
+                kind, t, d = self.records[self.position]
+                self.tx.append((now + (t - t_0) / self.speed, d))
+                self.position += 1
+        return len(data)
+
+    def release(self, now=None):
+        # called with condition locked, moves due chunks to input buffer
+        if now is None:
+            now = time.perf_counter()
+        while self.tx and self.tx[0][0] <= now:
+            self.rx += self.tx.popleft()[1]
+
+    def read(self, n=1, *args, **kwargs):
+        with self.condition:
+            self.release()
+            data = bytes(self.rx[:n])
+            del self.rx[:n]
+            return data
+
+    def readinto(self, buffer, *args, **kwargs):
+        with self.condition:
+            self.release()
+            n = min(len(buffer), len(self.rx))
+            buffer[:n] = memoryview(self.rx)[:n]
+            del self.rx[:n]
+            return n
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            self.release()
+            return len(self.rx)
+
+    def wait_readable(self, timeout):
+        with self.condition:
+            self.release()
+            if self.rx:
+                return True
+            next_time = self.tx[0][0] if self.tx else None
+        if next_time is None:
+            time.sleep(max(min(timeout, 0.001), 0.0))
+            return False
+        time.sleep(max(min(timeout, next_time - time.perf_counter()), 0.0))
+        return self.in_waiting > 0
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:]:
+        records = read_capture(name)
+        writes = [r for r in records if r[0] == WRITE]
+        reads = [r for r in records if r[0] == READ]
+        duration = records[-1][1] - records[0][1] if records else 0.0
+        print('%s: %d writes %d bytes, %d reads %d bytes, %.3f s' % (
+            name, len(writes), sum(len(r[2]) for r in writes),
+            len(reads), sum(len(r[2]) for r in reads), duration))
@@ -105,20 +105,24 @@ class ComPortControlledDevice:
             self.timeout_time = float('inf')
 
     def read(self, size=1, timeout=None):
-        result = b''
+        # input is collected in preallocated buffer
+        result = bytearray(size)
+        view = memoryview(result)
+        n = 0
         self.timeout = timeout
         try:
-            while len(result) < size:
-                if self.com.in_waiting > 0:
-                    r = self.com.read(1)
-                    if len(r) > 0:
-                        result += r
+            while n < size:
+                n += self.com.readinto(view[n:])
+                if n >= size:
+                    break
                 if self.timeout:
                     self.logger.error('Reading timeout')
-                    return result
+                    break
+                self.com.wait_readable(min(self.timeout_time - time.perf_counter(), 0.1))
         except:
             log_exception(self)
-        return result
+        view.release()
+        return bytes(result[:n])
 
     def read_until(self, terminator=TERMINATOR, size=None, timeout=READ_TIMEOUT):
         result = b''
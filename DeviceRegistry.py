@@ -0,0 +1,65 @@
+import weakref
+from threading import RLock
+
+
+class DeviceRegistry:
+    """Devices indexed by (port, addr) with per port index.
+
+    Weak references are stored, so registered devices can still be garbage collected.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._devices = weakref.WeakValueDictionary()
+        self._ports = {}
+
+    def add(self, device) -> bool:
+        # False if (port, addr) is registered by another device
+        key = (device.port, device.addr)
+        with self._lock:
+            d = self._devices.get(key)
+            if d is not None and d is not device:
+                return False
+            self._devices[key] = device
+            if device.port not in self._ports:
+                self._ports[device.port] = weakref.WeakValueDictionary()
+            self._ports[device.port][device.addr] = device
+            return True
+
+    def remove(self, device) -> bool:
+        key = (device.port, device.addr)
+        with self._lock:
+            if self._devices.get(key) is not device:
+                return False
+            del self._devices[key]
+            port = self._ports.get(device.port)
+            if port is not None:
+                port.pop(device.addr, None)
+                if len(port) == 0:
+                    del self._ports[device.port]
+            return True
+
+    def get(self, port: str, addr: int):
+        return self._devices.get((port, addr))
+
+    def on_port(self, port: str) -> list:
+        # live devices on port sorted by address
+        with self._lock:
+            devices = self._ports.get(port)
+            if devices is None:
+                return []
+            return [d for a, d in sorted(devices.items())]
+
+    def ports(self) -> list:
+        with self._lock:
+            return [p for p, d in self._ports.items() if len(d) > 0]
+
+    def __contains__(self, device) -> bool:
+        return self._devices.get((device.port, device.addr)) is device
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._devices.values()))
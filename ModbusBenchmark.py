@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Modbus transaction benchmark for ModbusDevice and ComPort stack.
+Drives emulated or pty-backed slaves and reports throughput, latency percentiles and CPU per transaction.
+Results are stored as JSON to compare versions:
+    python ModbusBenchmark.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import select
+import subprocess
+import sys
+import threading
+import time
+
+import numpy
+
+from ModbusDevice import ModbusDevice
+from ModbusEmulator import ModbusEmulator
+from config_logger import config_logger
+
+APPLICATION_NAME = 'Modbus transaction benchmark'
+APPLICATION_NAME_SHORT = 'ModbusBenchmark'
+APPLICATION_VERSION = '1.0'
+
+DEFAULT_PORTS = (1, 2, 4, 8)
+DEFAULT_DEVICES = (1, 4, 16, 64)
+
+
+class PtySlave:
+    """ModbusEmulator served on master side of pseudo terminal"""
+
+    def __init__(self, name: str, **kwargs):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.emulator = ModbusEmulator(name, **kwargs)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f'PtySlave {self.path}', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            r, w, x = select.select([self.master], [], [], 0.1)
+            if not r:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            self.emulator.write(data)
+            while self.emulator.tx:
+                self.emulator.wait_readable(0.1)
+                os.write(self.master, self.emulator.read(4096))
+
+    def close(self):
+        self.running = False
+        self.thread.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return ''
+
+
+def run_case(backend, n_ports, n_devices, duration, length, run_id, logger, **kwargs):
+    slaves = []
+    devices = []
+    for p in range(n_ports):
+        name = f'EMULATED-{run_id}-{n_ports}x{n_devices}-{p}'
+        if backend == 'pty':
+            slave = PtySlave(name, **kwargs)
+            slaves.append(slave)
+            port = slave.path
+            port_kwargs = {'baudrate': kwargs.get('baudrate', 115200), 'reader': kwargs.get('reader', False)}
+        else:
+            port = name
+            port_kwargs = dict(kwargs, emulated=ModbusEmulator)
+        for a in range(1, n_devices + 1):
+            devices.append(ModbusDevice(port, a, init_sleep=0.0, not_ready_sleep=0.0,
+                                        logger=logger, **port_kwargs))
+    latencies = [[] for d in devices]
+    errors = [0] * len(devices)
+    stop = threading.Event()
+
+    def worker(i, d):
+        lat = latencies[i]
+        while not stop.is_set():
+            t_0 = time.perf_counter()
+            data = d.modbus_read(0, length)
+            lat.append(time.perf_counter() - t_0)
+            if len(data) != length:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=worker, args=(i, d), daemon=True) for i, d in enumerate(devices)]
+    cpu_0 = time.process_time()
+    t_0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t_0
+    cpu = time.process_time() - cpu_0
+    # error breakdown from port metrics
+    error_codes = {}
+    for com in {id(d.com): d.com for d in devices}.values():
+        metrics = getattr(com, 'metrics', None)
+        if metrics is not None:
+            for name, count in metrics.snapshot()['error_names'].items():
+                error_codes[name] = error_codes.get(name, 0) + count
+    for d in devices:
+        d.remove()
+    for s in slaves:
+        s.close()
+    lat = numpy.concatenate([numpy.asarray(x) for x in latencies]) if devices else numpy.zeros(0)
+    n = len(lat)
+    p50, p95, p99 = numpy.percentile(lat, (50, 95, 99)) * 1000.0 if n else (0.0, 0.0, 0.0)
+    return {
+        'backend': backend,
+        'ports': n_ports,
+        'devices_per_port': n_devices,
+        'transactions': n,
+        'errors': sum(errors),
+        'error_codes': error_codes,
+        'tps': n / elapsed,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'cpu_per_tx_us': cpu / n * 1e6 if n else 0.0,
+    }
+
+
+def run(backend='emulated', ports=DEFAULT_PORTS, devices=DEFAULT_DEVICES, duration=2.0, length=10, **kwargs):
+    logger = config_logger(name=APPLICATION_NAME_SHORT, level=logging.WARNING)
+    logger.setLevel(logging.WARNING)
+    run_id = int(time.time())
+    results = []
+    for n_ports in ports:
+        for n_devices in devices:
+            r = run_case(backend, n_ports, n_devices, duration, length, run_id, logger, **kwargs)
+            print('%-8s %2d ports %3d dev/port %8d tx %5d err %9.1f tx/s  p50 %7.2f  p95 %7.2f  p99 %7.2f ms'
+                  '  cpu %7.1f us/tx' % (backend, n_ports, n_devices, r['transactions'], r['errors'], r['tps'],
+                                         r['p50_ms'], r['p95_ms'], r['p99_ms'], r['cpu_per_tx_us']))
+            results.append(r)
+    return {
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': dict(kwargs, backend=backend, duration=duration, length=length),
+        'results': results,
+    }
+
+
+def compare(new, old):
+    def key(r):
+        return r['backend'], r['ports'], r['devices_per_port']
+
+    old_results = {key(r): r for r in old['results']}
+    print('compared with %s (%s)' % (old.get('version', ''), old.get('time', '')))
+    for r in new['results']:
+        o = old_results.get(key(r))
+        if o is None:
+            continue
+        print('%-8s %2d ports %3d dev/port  tx/s %+6.1f%%  p99 %+6.1f%%  cpu %+6.1f%%' % (
+            r['backend'], r['ports'], r['devices_per_port'],
+            (r['tps'] / o['tps'] - 1.0) * 100.0 if o['tps'] else 0.0,
+            (r['p99_ms'] / o['p99_ms'] - 1.0) * 100.0 if o['p99_ms'] else 0.0,
+            (r['cpu_per_tx_us'] / o['cpu_per_tx_us'] - 1.0) * 100.0 if o['cpu_per_tx_us'] else 0.0))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=APPLICATION_NAME)
+    parser.add_argument('--backend', choices=('emulated', 'pty'), default='emulated')
+    parser.add_argument('--ports', type=int_list, default=list(DEFAULT_PORTS), help='comma separated port counts')
+    parser.add_argument('--devices', type=int_list, default=list(DEFAULT_DEVICES),
+                        help='comma separated device per port counts')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per case')
+    parser.add_argument('--length', type=int, default=10, help='registers per read')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--latency', type=float, default=ModbusEmulator.LATENCY, help='slave latency, s')
+    parser.add_argument('--reader', action='store_true', help='background reader thread in ComPort')
+    parser.add_argument('--output', default='', help='JSON results file')
+    parser.add_argument('--compare', default='', help='JSON results of previous version')
+    args = parser.parse_args()
+
+    if args.backend == 'pty' and not sys.platform.startswith('linux'):
+        print('pty backend requires Linux')
+        sys.exit(1)
+    result = run(args.backend, args.ports, args.devices, args.duration, args.length,
+                 baudrate=args.baudrate, latency=args.latency, reader=args.reader)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(result, indent=4))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(result, json.loads(f.read()))
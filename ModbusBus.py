@@ -0,0 +1,143 @@
+import collections
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+# priority classes, lower value is served first
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+PRIORITIES = (INTERACTIVE, NORMAL, BACKGROUND)
+
+
+class ModbusBusTimeout(Exception):
+    pass
+
+
+class ModbusBusQuarantined(Exception):
+    pass
+
+
+class _Transaction:
+    def __init__(self, func, args, kwargs, priority, deadline, device):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
+        self.device = device
+        self.submitted = time.time()
+        self.future = Future()
+
+
+class ModbusBus:
+    """Single worker executing transactions of all devices on one port by priority"""
+    STARVATION_TIME = 1.0
+    IDLE_TIMEOUT = 10.0
+
+    def __init__(self, com, **kwargs):
+        self.com = com
+        self.logger = kwargs.get('logger', getattr(com, 'logger', config_logger()))
+        self.starvation_time = kwargs.get('starvation_time', ModbusBus.STARVATION_TIME)
+        self.idle_timeout = kwargs.get('idle_timeout', ModbusBus.IDLE_TIMEOUT)
+        self.queues = {p: collections.deque() for p in PRIORITIES}
+        self.condition = threading.Condition()
+        self.worker = None
+        self.counter = itertools.count()
+        self.executed = 0
+        self.expired = 0
+        self.promoted = 0
+        self.skipped = 0
+
+    def submit(self, func, *args, priority=NORMAL, deadline=None, device=None, **kwargs) -> Future:
+        # deadline is relative time in seconds, transaction is dropped if not started before it
+        if priority not in self.queues:
+            priority = BACKGROUND if priority > BACKGROUND else INTERACTIVE
+        if deadline is None and device is not None:
+            deadline = getattr(device, 'deadline', None)
+        if deadline is not None:
+            deadline = time.time() + deadline
+        t = _Transaction(func, args, kwargs, priority, deadline, device)
+        with self.condition:
+            self.queues[priority].append(t)
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name=f'ModbusBus {self.port}', daemon=True)
+                self.worker.start()
+            self.condition.notify()
+        return t.future
+
+    @property
+    def port(self):
+        return getattr(self.com, 'port', '')
+
+    @property
+    def pending(self):
+        with self.condition:
+            return sum(len(q) for q in self.queues.values())
+
+    def next_transaction(self):
+        # called with condition locked
+        now = time.time()
+        # starvation protection: the oldest transaction of lower class waiting too long goes first
+        for p in reversed(PRIORITIES[1:]):
+            q = self.queues[p]
+            if q and now - q[0].submitted > self.starvation_time:
+                self.promoted += 1
+                return q.popleft()
+        for p in PRIORITIES:
+            q = self.queues[p]
+            if q:
+                return q.popleft()
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                t = self.next_transaction()
+                if t is None:
+                    self.condition.wait(self.idle_timeout)
+                    t = self.next_transaction()
+                    if t is None:
+                        # stop idle worker, it is restarted by next submit
+                        self.worker = None
+                        return
+            self.execute(t)
+
+    def execute(self, t):
+        if not t.future.set_running_or_notify_cancel():
+            return
+        if t.deadline is not None and time.time() > t.deadline:
+            self.expired += 1
+            t.future.set_exception(ModbusBusTimeout(f'{self.port} transaction deadline expired'))
+            return
+        if getattr(t.device, 'quarantined', False):
+            # dead slave is checked by its probes only, bus time goes to healthy devices
+            self.skipped += 1
+            t.future.set_exception(ModbusBusQuarantined(f'{self.port} device {t.device.addr} is quarantined'))
+            return
+        try:
+            with self.com.lock:
+                result = t.func(*t.args, **t.kwargs)
+            self.executed += 1
+            t.future.set_result(result)
+        except KeyboardInterrupt:
+            raise
+        except Exception as ex:
+            log_exception(self.logger, f'{self.port} Transaction exception')
+            t.future.set_exception(ex)
+
+    def cancel(self, device=None):
+        # cancel pending transactions of device, or all of them
+        n = 0
+        with self.condition:
+            for q in self.queues.values():
+                for t in list(q):
+                    if device is None or t.device is device:
+                        q.remove(t)
+                        t.future.cancel()
+                        n += 1
+        return n
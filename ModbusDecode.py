@@ -0,0 +1,81 @@
+import numpy
+
+# register data types, values are big endian inside each 16-bit register
+DTYPES = {
+    'int16': '>i2',
+    'uint16': '>u2',
+    'int32': '>i4',
+    'uint32': '>u4',
+    'float32': '>f4',
+    'int64': '>i8',
+    'uint64': '>u8',
+    'float64': '>f8',
+}
+WORD_ORDERS = ('big', 'little')
+
+
+def register_count(dtype: str) -> int:
+    return numpy.dtype(DTYPES[dtype]).itemsize // 2
+
+
+def _buffer(data):
+    # bytes-like objects are used as is, sequences of register values are packed to big endian words
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    if isinstance(data, numpy.ndarray) and data.dtype == numpy.uint8:
+        return data
+    return numpy.asarray(data, dtype='>u2')
+
+
+def registers_view(buffer, count: int, offset: int = 3) -> memoryview:
+    # register bytes of response without copy
+    return memoryview(buffer)[offset:offset + 2 * count]
+
+
+def registers_array(buffer, count: int = -1, offset: int = 0) -> numpy.ndarray:
+    # >u2 array over buffer without copy
+    return numpy.frombuffer(_buffer(buffer), dtype='>u2', count=count, offset=offset)
+
+
+def decode(data, dtype: str = 'float32', word_order: str = 'big', count: int = -1, offset: int = 0) -> numpy.ndarray:
+    """Decode registers to typed values.
+
+    data is response buffer (offset in bytes) or sequence of register values.
+    word_order 'big' means the most significant register first, 'little' - the least significant first.
+    Array is a view over data when no word swap is needed.
+    """
+    if word_order not in WORD_ORDERS:
+        raise ValueError(f'Wrong word order {word_order}')
+    dt = numpy.dtype(DTYPES[dtype])
+    buffer = _buffer(data)
+    if isinstance(buffer, numpy.ndarray) and buffer.dtype != numpy.uint8:
+        buffer = buffer.view(numpy.uint8)
+    if word_order == 'big' or dt.itemsize == 2:
+        return numpy.frombuffer(buffer, dtype=dt, count=count, offset=offset)
+    words = dt.itemsize // 2
+    raw = numpy.frombuffer(buffer, dtype='>u2', count=-1 if count < 0 else count * words, offset=offset)
+    raw = raw[:len(raw) // words * words].reshape(-1, words)[:, ::-1]
+    return numpy.ascontiguousarray(raw).view(dt).ravel()
+
+
+def encode(values, dtype: str = 'float32', word_order: str = 'big') -> list:
+    # typed values to list of register values for modbus_write
+    if word_order not in WORD_ORDERS:
+        raise ValueError(f'Wrong word order {word_order}')
+    dt = numpy.dtype(DTYPES[dtype])
+    raw = numpy.atleast_1d(numpy.asarray(values, dtype=dt)).view('>u2')
+    if word_order == 'little' and dt.itemsize > 2:
+        raw = raw.reshape(-1, dt.itemsize // 2)[:, ::-1].ravel()
+    return [int(v) for v in raw]
+
+
+def unpack_bits(data, count: int, offset: int = 0) -> numpy.ndarray:
+    # coil or discrete input bytes to bool array, the first bit is LSB of the first byte
+    raw = numpy.frombuffer(data, dtype=numpy.uint8, count=(count + 7) // 8, offset=offset)
+    return numpy.unpackbits(raw, count=count, bitorder='little').view(numpy.bool_)
+
+
+def pack_bits(values) -> bytes:
+    # bool sequence to coil bytes for write multiple coils
+    bits = numpy.asarray(values, dtype=numpy.bool_).ravel()
+    return numpy.packbits(bits, bitorder='little').tobytes()
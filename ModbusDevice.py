@@ -1,10 +1,22 @@
+import concurrent.futures
 import logging
 import os
 import sys
 import time
-from threading import Lock
+from threading import Lock, RLock
+
+import numpy
 
 from ComPort import EmptyComPort, ComPort
+from DeviceRegistry import DeviceRegistry
+from ModbusBus import INTERACTIVE, BACKGROUND
+from ModbusCRC import modbus_crc
+from ModbusFrame import ModbusFrameBuilder
+from ModbusMetrics import ModbusMetrics
+from ModbusParser import ModbusRTUParser, RESPONSE
+from ModbusDecode import registers_array, registers_view, decode, register_count, unpack_bits, pack_bits
+from ModbusTCP import ModbusTCPComPort
+from Reconnector import Reconnector, backoff_delay
 from ThreadSafeList import ThreadSafeList
 from config_logger import config_logger
 from log_exception import log_exception
@@ -13,46 +25,108 @@ APPLICATION_NAME = 'Modbus Device sceleton module Python API'
 APPLICATION_NAME_SHORT = 'ModbusDevice'
 APPLICATION_VERSION = '1.0'
 
-
-def modbus_crc(msg: bytes) -> int:
-    crc = 0xFFFF
-    for n in range(len(msg)):
-        crc ^= msg[n]
-        for i in range(8):
-            if crc & 1:
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    return crc
+# device health states
+HEALTH_OK = 'OK'
+HEALTH_SUSPENDED = 'SUSPENDED'
+HEALTH_RECOVERING = 'RECOVERING'
+HEALTH_FAILED = 'FAILED'
+# dead slave is polled only by short probes
+HEALTH_QUARANTINED = 'QUARANTINED'
+HEALTH_PROBING = 'PROBING'
 
 
 class ModbusDevice:
-    _devices = []
+    # registry of devices by (port, addr)
+    _devices = DeviceRegistry()
     _lock = Lock()
     SUSPEND_DELAY = 5.0
     READ_TIMEOUT = 1.0
     INIT_SLEEP = 0.5
     NOT_READY_SLEEP = 0.5
+    EVENT_READ = True
+    # adaptive timeout floor covering scheduling and USB adapter latency jitter,
+    # and extra silence allowed over 3.5 characters, not less than 16 ms latency timer of USB adapters
+    MIN_READ_TIMEOUT = 0.05
+    FRAME_GAP_MARGIN = 0.02
+    # RTT estimator gains, as in TCP retransmission timer
+    RTT_ALPHA = 0.125
+    RTT_BETA = 0.25
+    MAX_SUSPEND_DELAY = 60.0
+    # slave turnaround delay after broadcast request
+    BROADCAST_DELAY = 0.1
+    # ModbusRegisterCache attached to device, invalidated by modbus_write
+    register_cache = None
+    # consecutive failed recoveries
+    recover_attempts = 0
+    # quarantine after consecutive slave timeouts at full read timeout, probes at decaying rate,
+    # short probe timeout keeps port free for healthy devices, slower slaves need probe_timeout argument
+    QUARANTINE_TIMEOUTS = 3
+    PROBE_DELAY = 1.0
+    MAX_PROBE_DELAY = 30.0
+    PROBE_TIMEOUT = 0.1
+    # slave timeout and quarantine counters
+    timeouts = 0
+    total_timeouts = 0
+    quarantines = 0
+    probes = 0
+    probe_failures = 0
+    quarantine_since = 0.0
+    next_probe = 0.0
+    # device is in registry and holds COM port
+    registered = False
 
     def __init__(self, port: str, addr: int, **kwargs):
+        self.health = HEALTH_RECOVERING
         # default com port, id, serial number, and ...
         self.not_ready_sleep = kwargs.pop('not_ready_sleep', ModbusDevice.NOT_READY_SLEEP)
         self.init_sleep = kwargs.pop('init_sleep', ModbusDevice.INIT_SLEEP)
         if self.init_sleep> 0.0:
             time.sleep(self.init_sleep)
         self.com = EmptyComPort()
+        # device lock for pipelined transports
+        self.lock = RLock()
         self.id = 'Unknown Device'
         self.sn = ''
         self.suspend_to = 0.0
         self.port = str(port).strip()
         self.addr = int(addr)
+        # transaction metrics
+        self.metrics = ModbusMetrics(f'{self.port}:{self.addr}')
         self.error = 0
         self.command = 0
         self.request = b''
         self.response = b''
+        # maximal response timeout
         self.read_timeout = kwargs.pop('read_timeout', ModbusDevice.READ_TIMEOUT)
+        self.read_deadline = 0.0
+        self.write_time = 0.0
+        # response timeout from RTT estimate, end of frame by silence on serial lines
+        self.adaptive_timeout = kwargs.pop('adaptive_timeout', True)
+        self.min_read_timeout = kwargs.pop('min_read_timeout', ModbusDevice.MIN_READ_TIMEOUT)
+        self.frame_gap_margin = kwargs.pop('frame_gap_margin', ModbusDevice.FRAME_GAP_MARGIN)
+        # RTT estimate
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto_backoff = 1
         self.suspend_delay = kwargs.pop('suspend_delay', ModbusDevice.SUSPEND_DELAY)
+        # suspension grows exponentially with failed recoveries up to max_suspend_delay
+        self.max_suspend_delay = kwargs.pop('max_suspend_delay', ModbusDevice.MAX_SUSPEND_DELAY)
+        # wait for input on port descriptor instead of 1 ms polling
+        self.event_read = kwargs.pop('event_read', ModbusDevice.EVENT_READ)
+        self.broadcast_delay = kwargs.pop('broadcast_delay', ModbusDevice.BROADCAST_DELAY)
+        # 0 disables quarantine, slave timeouts are handled by suspend
+        self.quarantine_timeouts = kwargs.pop('quarantine_timeouts', ModbusDevice.QUARANTINE_TIMEOUTS)
+        self.probe_delay = kwargs.pop('probe_delay', ModbusDevice.PROBE_DELAY)
+        self.max_probe_delay = kwargs.pop('max_probe_delay', ModbusDevice.MAX_PROBE_DELAY)
+        self.probe_timeout = min(kwargs.pop('probe_timeout', ModbusDevice.PROBE_TIMEOUT), self.read_timeout)
+        # holding register read by probe, any response including exception proves slave is alive
+        self.probe_register = kwargs.pop('probe_register', 0)
+        # reusable request frame buffer, input is received to buffer of the port
+        self.frame = ModbusFrameBuilder()
+        # response frames parser, resynchronizes after noise
+        self.parser = ModbusRTUParser(RESPONSE, (self.addr,))
+        # default deadline for transactions submitted to port bus scheduler
+        self.deadline = kwargs.pop('deadline', None)
         # logger
         self.logger = kwargs.get('logger', config_logger(level=logging.DEBUG))
         # logs prefix
@@ -65,41 +139,53 @@ class ModbusDevice:
         if self.addr <= 0:
             self.warning('Wrong address')
             self.suspend(1e6)
+            self.health = HEALTH_FAILED
             return
-        # check if port:address is in use
-        with ModbusDevice._lock:
-            for d in ModbusDevice._devices:
-                if d != self and d.port == self.port and d.addr == self.addr and d.state > 0:
-                    self.warning('Address is in use')
-                    self.suspend(1e6)
-                    return
-        # add device to list
+        # check if port:address is in use and add device to registry
         with ModbusDevice._lock:
-            if self not in ModbusDevice._devices:
-                ModbusDevice._devices.append(self)
+            if not ModbusDevice._devices.add(self):
+                self.warning('Address is in use')
+                self.close_com_port()
+                self.suspend(1e6)
+                self.health = HEALTH_FAILED
+                return
+            self.registered = True
         if not self.com.ready:
             self.info('COM port not ready')
             self.suspend()
             return
         self.id = 'Modbus device'
         self.pre = f'{self.id} at {self.port}: {self.addr} '
+        self.health = HEALTH_OK
         self.info(f'initialized')
         return
 
     def __del__(self):
         with ModbusDevice._lock:
-            if self in ModbusDevice._devices:
-                self.close_com_port()
+            if self.registered:
+                self.registered = False
                 ModbusDevice._devices.remove(self)
+                self.close_com_port()
                 self.debug('has been deleted')
 
     def remove(self):
+        Reconnector.instance().cancel(self)
         with ModbusDevice._lock:
-            if self in ModbusDevice._devices:
-                self.close_com_port()
+            if self.registered:
+                self.registered = False
                 ModbusDevice._devices.remove(self)
+                self.close_com_port()
                 self.info('has been removed')
 
+    @staticmethod
+    def find(port: str, addr: int):
+        return ModbusDevice._devices.get(str(port).strip(), int(addr))
+
+    @staticmethod
+    def devices_on_port(port: str) -> list:
+        # live devices on port, for schedulers and diagnostics
+        return ModbusDevice._devices.on_port(str(port).strip())
+
     def debug(self, msg, *args, **kwargs):
         sl = kwargs.pop('stacklevel', 1)
         if sys.version_info.major >= 3 and sys.version_info.minor >= 8:
@@ -121,12 +207,26 @@ class ModbusDevice:
     def create_com_port(self):
         if 'baudrate' not in self.kwargs:
             self.kwargs['baudrate'] = 115200
-        self.com = ComPort(self.port, emulated=EmptyComPort, **self.kwargs)
+        # emulated class is used for FAKE... and EMULATED... ports
+        kwargs = dict(self.kwargs)
+        emulated = kwargs.pop('emulated', EmptyComPort)
+        self.com = ComPort(self.port, emulated=emulated, **kwargs)
+        # line timing from baudrate, 11 bits per character
+        baudrate = self.kwargs['baudrate']
+        self.char_time = 11.0 / baudrate
+        if self.adaptive_timeout and self.port.startswith(('COM', 'tty', '/dev', 'cua', 'FAKE', 'EMULATED')):
+            # 3.5 characters silence, fixed 1.75 ms above 19200 baud
+            self.frame_gap = (0.00175 if baudrate > 19200 else 3.5 * self.char_time) + self.frame_gap_margin
+        else:
+            # network gateways split frames arbitrarily
+            self.frame_gap = None
         return self.com
 
-    def close_com_port(self):
+    def close_com_port(self, com=None):
+        if com is None:
+            com = self.com
         try:
-            self.com.close()
+            com.close()
         except KeyboardInterrupt:
             raise
         except:
@@ -136,10 +236,106 @@ class ModbusDevice:
         if time.time() < self.suspend_to:
             return
         if duration is None:
-            duration = self.suspend_delay
+            duration = backoff_delay(self.suspend_delay, self.recover_attempts, self.max_suspend_delay)
         self.suspend_to = time.time() + duration
+        self.health = HEALTH_SUSPENDED
         self.debug('suspended for %5.2f sec', duration)
 
+    def recover(self):
+        # runs in Reconnector thread, only port and health are rebuilt,
+        # transaction fields of threads using the device are not touched
+        if self.health != HEALTH_RECOVERING:
+            return
+        if not self.registered:
+            return
+        self.recover_attempts += 1
+        # new reference to shared port is taken before the old one is released,
+        # port is not closed under other devices and its lock is not held while it opens
+        old = self.com
+        self.create_com_port()
+        self.close_com_port(old)
+        with self.io_lock:
+            if self.health != HEALTH_RECOVERING:
+                return
+            if not self.com.ready:
+                self.info('COM port not ready')
+                self.suspend()
+                return
+            self.suspend_to = 0.0
+            self.id = 'Modbus device'
+            self.pre = f'{self.id} at {self.port}: {self.addr} '
+            self.health = HEALTH_OK
+            self.info('recovered')
+
+    @property
+    def quarantined(self) -> bool:
+        return self.health == HEALTH_QUARANTINED
+
+    def slave_timeout(self):
+        # no response from slave, port is working
+        self.timeouts += 1
+        self.total_timeouts += 1
+        if self.quarantine_timeouts <= 0:
+            self.suspend()
+        elif self.timeouts >= self.quarantine_timeouts and self.health == HEALTH_OK:
+            self.quarantine()
+
+    def quarantine(self):
+        self.health = HEALTH_QUARANTINED
+        self.quarantines += 1
+        self.probe_failures = 0
+        self.quarantine_since = time.time()
+        self.schedule_probe()
+        self.warning('no response for %d requests, quarantined', self.timeouts)
+
+    def schedule_probe(self):
+        delay = backoff_delay(self.probe_delay, self.probe_failures, self.max_probe_delay)
+        self.next_probe = time.time() + delay
+        Reconnector.instance().schedule(self.probe, key=self, delay=delay)
+
+    def probe(self) -> bool:
+        # runs in Reconnector thread, short read to check quarantined slave
+        if self.health != HEALTH_QUARANTINED:
+            return False
+        with self.io_lock:
+            self.health = HEALTH_PROBING
+            self.probes += 1
+            self.metrics.record_retry()
+            self.command = 3
+            msg = self.frame.read_request(self.addr, self.command, self.probe_register, 1)
+            try:
+                self.transact(msg, False, timeout=self.probe_timeout)
+            finally:
+                answered = self.response[:1] == bytes((self.addr,)) and self.error != 259
+                if answered:
+                    self.timeouts = 0
+                    self.health = HEALTH_OK
+                elif self.health == HEALTH_PROBING:
+                    self.health = HEALTH_QUARANTINED
+        if answered:
+            self.info('answered probe, quarantine ended after %.1f s', time.time() - self.quarantine_since)
+            return True
+        if self.health == HEALTH_QUARANTINED:
+            self.probe_failures += 1
+            self.schedule_probe()
+        return False
+
+    def quarantine_info(self) -> dict:
+        # quarantine state and counters for monitoring
+        now = time.time()
+        quarantined = self.health in (HEALTH_QUARANTINED, HEALTH_PROBING)
+        return {
+            'health': self.health,
+            'quarantined': quarantined,
+            'timeouts': self.timeouts,
+            'total_timeouts': self.total_timeouts,
+            'quarantines': self.quarantines,
+            'probes': self.probes,
+            'probe_failures': self.probe_failures,
+            'quarantined_for': now - self.quarantine_since if quarantined else 0.0,
+            'next_probe': max(self.next_probe - now, 0.0) if quarantined else 0.0,
+        }
+
     @staticmethod
     def checksum(cmd: bytes) -> bytes:
         return modbus_crc(cmd).to_bytes(2, 'little')
@@ -151,26 +347,28 @@ class ModbusDevice:
         cs = self.checksum(cmd[:-2])
         return cmd[-2:] == cs
 
-    def write(self, cmd) -> bool:
+    def write(self, cmd, checksum=True) -> bool:
+        # checksum=False for frames already containing checksum
         with self.com.lock:
             if not self.ready:
                 self.error = 262
-                if self.not_ready_sleep > 0.0:
+                if self.not_ready_sleep > 0.0 and not self.quarantined:
                     time.sleep(self.not_ready_sleep)
                 return False
             if isinstance(cmd, str):
                 cmd = cmd.encode()
-            if not isinstance(cmd, bytes):
+            if not isinstance(cmd, (bytes, bytearray, memoryview)):
                 return False
+            if self.error != 0:
+                # previous transaction failed, late response may be buffered
+                self.com.reset_input_buffer()
+            # stale bytes are skipped by parser
+            self.parser.clear()
             self.error = 0
-            self.com.reset_input_buffer()
-            self.com.reset_output_buffer()
-            self.com.read()
-            self.com.read()
-            # while self.com.in_waiting > 0:
-            #     self.com.read()
-            cmd = self.add_checksum(cmd)
-            self.request = cmd
+            if checksum:
+                cmd = self.add_checksum(cmd)
+            self.request = bytes(cmd)
+            self.write_time = time.time()
             n = self.com.write(cmd)
             if len(cmd) != n:
                 self.error = 263
@@ -179,61 +377,127 @@ class ModbusDevice:
             return True
 
     def read_witn_timeout(self, timeout, length) -> bool:
-        while time.time() < timeout and len(self.response) < length:
-            self.response += self.com.read(1000)
-            time.sleep(0.001)
-        if time.time() >= timeout:
-            return False
+        # called with port lock, bytes after length are left in port for the next frame
+        view = self.com.receive_view
+        last = time.time()
+        while len(self.response) < length:
+            n = len(self.response)
+            k = self.com.readinto(view[:length - n])
+            self.response += view[:k]
+            if len(self.response) >= length:
+                break
+            now = time.time()
+            if len(self.response) > n:
+                last = now
+            elif n > 0 and self.frame_gap is not None and now - last > self.frame_gap:
+                # silence inside frame, frame is incomplete
+                return False
+            dt = timeout - now
+            if dt <= 0.0:
+                return False
+            if n > 0 and self.frame_gap is not None:
+                dt = min(dt, self.frame_gap)
+            if self.event_read:
+                # block on port descriptor until input arrives or timeout expires
+                self.com.wait_readable(dt)
+            else:
+                time.sleep(0.001)
         return True
 
-    def read(self, extra_bytes=5) -> bool:
+    def read(self, timeout=None) -> bool:
+        # timeout overrides response timeout from RTT estimate
         with self.com.lock:
             if not self.ready:
                 self.error = 262
-                if self.not_ready_sleep > 0.0:
+                if self.not_ready_sleep > 0.0 and not self.quarantined:
                     time.sleep(self.not_ready_sleep)
                 return False
             self.error = 0
             self.response = b''
-            self.read_timeout = time.time() + self.READ_TIMEOUT
-            while time.time() < self.read_timeout and len(self.response) < 3:
-                self.response += self.com.read(1000)
-                time.sleep(0.001)
-            # read timeout
-            if time.time() >= self.read_timeout:
-                self.error = 259
-                self.suspend()
-                return False
-            # addr check
-            if int(self.response[0]) != self.addr:
-                self.error = 260
-                return False
-            # op code check
-            op = int(self.response[1])
-            if op != self.command and op != (self.command + 128):
-                self.error = 261
-                self.logger.error(f'OP code != self.command {self.response} {self.command}')
-                return False
-            # calculate expected length of input
-            if op > 128:
-                # 5 bytes for error response
-                k = 5
-            elif op > 4 and op < 17:
-                # single-byte operations
-                k = 8
-            else:
-                # multi-byte operations
-                k = int(self.response[2]) + extra_bytes
-            # wait for next bytes
-            while time.time() < self.read_timeout and len(self.response) < k:
-                self.response += self.com.read(1000)
-                time.sleep(0.001)
-            if time.time() >= self.read_timeout:
-                self.error = 259
-                self.suspend()
-                return False
-            resp = self.check_response(self.response)
-            return resp
+            start = self.write_time if self.write_time > 0.0 else time.time()
+            self.read_deadline = start + (self.response_timeout() if timeout is None else timeout)
+            header = False
+            last = time.time()
+            # port receive buffer is used under port lock
+            view = self.com.receive_view
+            while True:
+                k = self.com.readinto(view)
+                data = view[:k]
+                now = time.time()
+                if k > 0:
+                    last = now
+                    frames = self.parser.feed(data)
+                elif (self.parser.pending > 0 and not header and self.frame_gap is not None
+                      and now - last > self.frame_gap):
+                    # silence marks frame end, take frame behind noise and drop the rest,
+                    # frame of known length after valid header is awaited until deadline
+                    frames = self.parser.flush()
+                else:
+                    frames = ()
+                for frame in frames:
+                    if frame[0] != self.addr:
+                        # late response or other slave, skip it
+                        self.debug('Unexpected frame %s skipped', frame)
+                        continue
+                    self.response = frame
+                    # op code check
+                    if frame[1] & 0x7F != self.command:
+                        self.error = 261
+                        self.logger.error(f'OP code != self.command {self.response} {self.command}')
+                        return False
+                    # slave answers, reset suspension backoff and timeout counter
+                    self.recover_attempts = 0
+                    self.timeouts = 0
+                    if self.adaptive_timeout and not header:
+                        self.update_rtt(now - start - (len(self.request) + len(frame)) * self.char_time)
+                    return self.check_response(frame)
+                buf = self.parser.buffer
+                if k > 0 and not header and len(buf) >= 3 and buf[0] == self.addr and buf[1] & 0x7F == self.command:
+                    # response header received
+                    header = True
+                    if self.adaptive_timeout:
+                        self.update_rtt(now - start - (len(self.request) + len(buf)) * self.char_time)
+                        # remaining bytes arrive at line rate
+                        k = self.parser.expected_length()
+                        self.read_deadline = min(start + self.read_timeout,
+                                                 now + (k - len(buf)) * self.char_time + self.min_read_timeout)
+                dt = self.read_deadline - now
+                if dt <= 0.0:
+                    # read timeout
+                    self.error = 259
+                    self.response = bytes(self.parser.buffer)
+                    if not header and timeout is None:
+                        # the next request waits longer, up to read_timeout
+                        self.rto_backoff = min(2 * self.rto_backoff, 64)
+                    if self.read_deadline >= start + self.read_timeout:
+                        # only silence for full read timeout counts toward quarantine
+                        self.slave_timeout()
+                    return False
+                if self.parser.pending > 0 and not header and self.frame_gap is not None:
+                    dt = min(dt, self.frame_gap)
+                if self.event_read:
+                    # block on port descriptor until input arrives or timeout expires
+                    self.com.wait_readable(dt)
+                else:
+                    time.sleep(0.001)
+
+    def response_timeout(self) -> float:
+        # time from request write to response header
+        if not self.adaptive_timeout or self.srtt is None:
+            return self.read_timeout
+        rto = self.srtt + 4.0 * self.rttvar + (len(self.request) + 3) * self.char_time
+        return min(max(rto, self.min_read_timeout) * self.rto_backoff, self.read_timeout)
+
+    def update_rtt(self, sample: float):
+        # slave turnaround time estimate, EWMA of mean and deviation
+        sample = max(sample, 0.0)
+        self.rto_backoff = 1
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2.0
+            return
+        self.rttvar = (1.0 - self.RTT_BETA) * self.rttvar + self.RTT_BETA * abs(self.srtt - sample)
+        self.srtt = (1.0 - self.RTT_ALPHA) * self.srtt + self.RTT_ALPHA * sample
 
     def check_response(self, cmd: bytes) -> bool:
         self.error = 0
@@ -252,26 +516,147 @@ class ModbusDevice:
             return False
         return self.verify_checksum(cmd)
 
-    def modbus_read(self, start: int, length: int=1, address=None, command=3):
-        with self.com.lock:
+    @property
+    def pipelined(self) -> bool:
+        # transport matches responses by transaction id, no need to hold port lock
+        return isinstance(getattr(self.com, 'device', None), ModbusTCPComPort)
+
+    @property
+    def io_lock(self):
+        if self.pipelined:
+            return self.lock
+        return self.com.lock
+
+    def transact(self, msg, checksum=True, timeout=None) -> bool:
+        # send request and receive response, checksum=False for frames already containing checksum
+        t_0 = time.perf_counter()
+        if self.pipelined:
+            result = self.transact_pipelined(msg, checksum, timeout)
+        else:
+            result = self.write(msg, checksum) and self.read(timeout)
+        self.record_metrics(time.perf_counter() - t_0)
+        return result
+
+    def record_metrics(self, latency: float):
+        self.metrics.record(latency, len(self.request), len(self.response), self.error)
+        port_metrics = getattr(self.com, 'metrics', None)
+        if port_metrics is not None:
+            port_metrics.record(latency, len(self.request), len(self.response), self.error)
+
+    def transact_pipelined(self, msg, checksum=True, timeout=None) -> bool:
+        if not self.ready:
+            self.error = 262
+            if self.not_ready_sleep > 0.0 and not self.quarantined:
+                time.sleep(self.not_ready_sleep)
+            return False
+        self.error = 0
+        if checksum:
+            self.request = self.add_checksum(msg)
+        else:
+            self.request = bytes(msg)
+        self.response = b''
+        future = None
+        try:
+            future = self.com.device.transact(self.request[0], self.request[1:-2])
+            if timeout is None:
+                timeout = self.read_timeout
+            unit, pdu = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.error = 259
+            if future is None:
+                # transaction window of port is full, the slave is not at fault
+                return False
+            future.cancel()
+            if timeout >= self.read_timeout:
+                self.slave_timeout()
+            return False
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self, f'{self.pre} Transaction exception')
+            if future is not None:
+                future.cancel()
+            self.error = 263
+            self.com.suspend()
+            self.suspend()
+            return False
+        self.response = self.add_checksum(bytes((unit,)) + pdu)
+        self.recover_attempts = 0
+        self.timeouts = 0
+        return self.check_response(self.response)
+
+    def modbus_read(self, start: int, length: int=1, address=None, command=3, output='list'):
+        # output: 'list' of ints, 'numpy' >u2 array or 'memoryview' over response without per register copies
+        with self.io_lock:
             self.command = command
             if address is None:
                 address = self.addr
-            msg = address.to_bytes(1, byteorder='big') + self.command.to_bytes(1, byteorder='big')
-            msg += int.to_bytes(start, 2, byteorder='big')
-            msg += int.to_bytes(length, 2, byteorder='big')
+            msg = self.frame.read_request(address, self.command, start, length)
             data = []
-            if not self.write(msg):
+            if not self.transact(msg, False):
                 return data
-            if not self.read():
+            if self.response[2] != 2 * length:
+                # valid frame with wrong register count
+                self.error = 260
                 return data
+            if output == 'numpy':
+                return registers_array(self.response, length, 3)
+            if output == 'memoryview':
+                return registers_view(self.response, length, 3)
             for i in range(length):
                 data.append(int.from_bytes(self.response[2 * i + 3:2 * i + 5], byteorder='big'))
             return data
 
+    def modbus_read_typed(self, start: int, count: int = 1, dtype='float32', word_order='big', address=None, command=3):
+        # read count values of dtype packed in consecutive registers, returns numpy array (empty on error)
+        n = count * register_count(dtype)
+        with self.io_lock:
+            regs = self.modbus_read(start, n, address=address, command=command, output='memoryview')
+            if len(regs) < 2 * n:
+                return decode(b'', dtype)
+            return decode(regs, dtype, word_order, count)
+
+    def modbus_read_bits(self, start: int, count: int = 1, address=None, command=1):
+        # read coils (1) or discrete inputs (2), returns numpy bool array (empty on error)
+        with self.io_lock:
+            if not 1 <= count <= 2000:
+                self.logger.error(f'{self.pre} Wrong bit count {count}')
+                return numpy.zeros(0, dtype=numpy.bool_)
+            self.command = command
+            if address is None:
+                address = self.addr
+            msg = self.frame.read_request(address, self.command, start, count)
+            if not self.transact(msg, False):
+                return numpy.zeros(0, dtype=numpy.bool_)
+            if self.response[2] < (count + 7) // 8:
+                self.error = 260
+                return numpy.zeros(0, dtype=numpy.bool_)
+            return unpack_bits(self.response, count, 3)
+
+    def modbus_write_bits(self, start: int, values, address=None, command=15) -> int:
+        # write coils, command 5 writes single coil, returns number of written coils (0 on error)
+        with self.io_lock:
+            values = numpy.atleast_1d(numpy.asarray(values, dtype=numpy.bool_)).ravel()
+            count = len(values)
+            if not 1 <= count <= 1968 or (command == 5 and count != 1):
+                self.logger.error(f'{self.pre} Wrong coil count {count}')
+                return 0
+            self.command = command
+            if address is None:
+                address = self.addr
+            if command == 5:
+                msg = self.frame.read_request(address, self.command, start, 0xFF00 if values[0] else 0)
+            else:
+                msg = self.frame.write_bits_request(address, self.command, start, count, pack_bits(values))
+            if not self.transact(msg, False):
+                return 0
+            if command == 5:
+                return 1
+            return int.from_bytes(self.response[4:6], byteorder='big')
+
     def modbus_write(self, start: int, data, address=None, command=16) -> int:
         # print('modbus_write', start, data)
-        with self.com.lock:
+        with self.io_lock:
             if isinstance(data, int):
                 data = [data,]
             try:
@@ -282,39 +667,189 @@ class ModbusDevice:
             self.command = command
             if address is None:
                 address = self.addr
-            msg = address.to_bytes(1, byteorder='big') + self.command.to_bytes(1, byteorder='big')
-            msg += int.to_bytes(start, 2, byteorder="big")
-            out = b''
-            for d in data:
-                if isinstance(d, int):
-                    out += d.to_bytes(2, byteorder='big')
-                elif isinstance(d, bytes):
-                    out += d
-                else:
-                    self.logger.error('Wrong data format for write')
-                    return 0
-            length = len(out)
-            msg += int.to_bytes(length // 2, 2, byteorder="big")
-            msg += int.to_bytes(length, 1, byteorder='big')
-            msg += out
-            # print('modbus_write msg', msg)
-            if not self.write(msg):
+            try:
+                msg = self.frame.write_request(address, self.command, start, data)
+            except ValueError as ex:
+                self.logger.error(f'{self.pre} {ex}')
                 return 0
-            if not self.read():
+            # print('modbus_write msg', msg)
+            if self.register_cache is not None and address == self.addr:
+                self.register_cache.invalidate(start, msg[6] // 2)
+            if not self.transact(msg, False):
                 return 0
             data = int.from_bytes(self.response[4:6], byteorder='big')
             # print('modbus_write data', data)
             return data
 
+    def invalidate_caches(self, start: int, length: int, addresses=None):
+        # drop cached registers of devices on this port written by broadcast or group write
+        for d in ModbusDevice.devices_on_port(self.port):
+            if d.register_cache is not None and (addresses is None or d.addr in addresses):
+                d.register_cache.invalidate(start, length)
+
+    def modbus_broadcast_write(self, start: int, data, command=16) -> bool:
+        # write registers of all slaves (address 0), no response is expected
+        t_0 = time.perf_counter()
+        with self.io_lock:
+            if isinstance(data, int):
+                data = [data, ]
+            self.command = command
+            try:
+                msg = self.frame.write_request(0, command, start, data)
+            except ValueError as ex:
+                self.logger.error(f'{self.pre} {ex}')
+                return False
+            self.invalidate_caches(start, msg[6] // 2)
+            if self.pipelined:
+                if not self.ready:
+                    self.error = 262
+                    return False
+                self.request = bytes(msg)
+                try:
+                    self.com.device.transact(0, msg[1:-2]).cancel()
+                except KeyboardInterrupt:
+                    raise
+                except:
+                    log_exception(self, f'{self.pre} Broadcast exception')
+                    self.error = 263
+                    return False
+            elif not self.write(msg, False):
+                return False
+            self.response = b''
+            self.record_metrics(time.perf_counter() - t_0)
+            # request transmission and slaves turnaround before next request
+            time.sleep(len(msg) * self.char_time + self.broadcast_delay)
+            return True
+
+    def modbus_group_write(self, addresses, start: int, data, command=16) -> dict:
+        """Write the same registers to list of slaves.
+
+        On pipelined Modbus TCP requests are outstanding together and responses are collected afterward,
+        on RTU lines requests are written one by one, frames sent back to back without t3.5 silence
+        would be seen by slaves as one corrupted frame.
+        Returns {address: error code}, 0 for success.
+        """
+        addresses = [int(a) for a in addresses]
+        errors = {a: 262 for a in addresses}
+        if isinstance(data, int):
+            data = [data, ]
+        with self.io_lock:
+            self.command = command
+            try:
+                frames = [bytes(self.frame.write_request(a, command, start, data)) for a in addresses]
+            except ValueError as ex:
+                self.logger.error(f'{self.pre} {ex}')
+                return errors
+            if not frames:
+                return errors
+            self.invalidate_caches(start, frames[0][6] // 2, addresses)
+            if self.pipelined:
+                return self.group_write_pipelined(addresses, frames, errors)
+            for a, frame in zip(addresses, frames):
+                errors[a] = self.group_write_one(a, frame)
+            self.error = next((e for e in errors.values() if e != 0), 0)
+        return errors
+
+    def group_write_one(self, addr: int, frame: bytes) -> int:
+        # single request of RTU group write, returns error code
+        t_0 = time.perf_counter()
+        if not self.write(frame, False):
+            error = self.error
+        else:
+            with self.com.lock:
+                self.response = bytearray()
+                self.read_deadline = self.write_time + (len(frame) + 8) * self.char_time + self.response_timeout()
+                error = 259
+                if self.read_witn_timeout(self.read_deadline, 2):
+                    k = 5 if self.response[1] & 0x80 else 8
+                    if self.read_witn_timeout(self.read_deadline, k):
+                        error = self.check_group_response(addr, self.response[:k])
+        # late response is flushed before next request
+        self.error = error
+        self.record_metrics(time.perf_counter() - t_0)
+        return error
+
+    def group_write_pipelined(self, addresses, frames, errors) -> dict:
+        if not self.ready:
+            return errors
+        futures = {}
+        try:
+            for a, f in zip(addresses, frames):
+                futures[a] = self.com.device.transact(a, f[1:-2])
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self, f'{self.pre} Group write exception')
+        deadline = time.time() + self.read_timeout
+        for a, future in futures.items():
+            try:
+                unit, pdu = future.result(max(deadline - time.time(), 0.0))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                errors[a] = 259
+                continue
+            except KeyboardInterrupt:
+                raise
+            except:
+                errors[a] = 263
+                continue
+            errors[a] = self.check_group_response(a, self.add_checksum(bytes((unit,)) + pdu))
+        return errors
+
+    def check_group_response(self, addr: int, frame: bytes) -> int:
+        if frame[0] != addr:
+            return 257
+        if frame[1] & 0x80:
+            return frame[2]
+        if frame[1] != self.command:
+            return 258
+        if not self.verify_checksum(frame):
+            return 260
+        return 0
+
+    def modbus_write_read(self, write_start: int, data, read_start: int, read_length: int = 1,
+                          address=None, command=23, output='list'):
+        # write registers and read registers in one transaction (function code 23)
+        with self.io_lock:
+            if isinstance(data, int):
+                data = [data, ]
+            self.command = command
+            if address is None:
+                address = self.addr
+            try:
+                msg = self.frame.write_read_request(address, read_start, read_length, write_start, data, command)
+            except ValueError as ex:
+                self.logger.error(f'{self.pre} {ex}')
+                return []
+            if self.register_cache is not None and address == self.addr:
+                self.register_cache.invalidate(write_start, msg[10] // 2)
+            if not self.transact(msg, False):
+                return []
+            if output == 'numpy':
+                return registers_array(self.response, read_length, 3)
+            if output == 'memoryview':
+                return registers_view(self.response, read_length, 3)
+            return [int.from_bytes(self.response[2 * i + 3:2 * i + 5], byteorder='big') for i in range(read_length)]
+
+    def submit_read(self, start: int, length: int = 1, priority=BACKGROUND, deadline=None, **kwargs):
+        # schedule modbus_read on port bus, returns Future
+        return self.com.bus.submit(self.modbus_read, start, length, priority=priority,
+                                   deadline=deadline, device=self, **kwargs)
+
+    def submit_write(self, start: int, data, priority=INTERACTIVE, deadline=None, **kwargs):
+        # schedule modbus_write on port bus, returns Future
+        return self.com.bus.submit(self.modbus_write, start, data, priority=priority,
+                                   deadline=deadline, device=self, **kwargs)
+
     @property
     def ready(self):
-        if time.time() < self.suspend_to:
-            return False
-        # was suspended try to init
-        if self.suspend_to > 0.0:
-            self.__del__()
-            self.__init__(self.port, self.addr, **self.kwargs)
-        return self.suspend_to <= 0.0
+        # constant time, suspended device is re-initialized by background worker
+        if self.health == HEALTH_OK or self.health == HEALTH_PROBING:
+            return True
+        if self.health == HEALTH_SUSPENDED and time.time() >= self.suspend_to:
+            self.health = HEALTH_RECOVERING
+            Reconnector.instance().schedule(self.recover, key=self)
+        return False
 
 
 def print_ints(arr, r, base=None):
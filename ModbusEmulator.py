@@ -0,0 +1,304 @@
+import random
+import struct
+import time
+from collections import deque
+from threading import RLock
+
+from ModbusCRC import modbus_crc
+from ModbusParser import request_length
+from config_logger import config_logger
+
+# slave exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+SLAVE_DEVICE_FAILURE = 4
+
+
+class ModbusSlaveException(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class ModbusSlave:
+    """Register banks of one emulated slave"""
+
+    def __init__(self, holding=None, input_registers=None, coils=None, discrete_inputs=None, strict=False,
+                 server_id=b'EMULATOR'):
+        self.holding = dict(holding or {})
+        self.input = dict(input_registers or {})
+        self.coils = {a: bool(v) for a, v in (coils or {}).items()}
+        self.discrete = {a: bool(v) for a, v in (discrete_inputs or {}).items()}
+        # returned by report server id (17) with run indicator
+        self.server_id = bytes(server_id)
+        # strict slave answers ILLEGAL_DATA_ADDRESS for undefined registers
+        self.strict = strict
+        self.lock = RLock()
+
+    def get(self, bank, start, length):
+        if self.strict and any(a not in bank for a in range(start, start + length)):
+            raise ModbusSlaveException(ILLEGAL_DATA_ADDRESS)
+        return [bank.get(a, 0) for a in range(start, start + length)]
+
+    def set(self, bank, start, values):
+        if self.strict and any(a not in bank for a in range(start, start + len(values))):
+            raise ModbusSlaveException(ILLEGAL_DATA_ADDRESS)
+        for i, v in enumerate(values):
+            bank[start + i] = v
+
+    def process(self, pdu: bytes) -> bytes:
+        # request pdu (function code and data) -> response pdu
+        fc = pdu[0]
+        try:
+            with self.lock:
+                if fc in (3, 4):
+                    start, length = struct.unpack_from('>HH', pdu, 1)
+                    if not 1 <= length <= 125:
+                        raise ModbusSlaveException(ILLEGAL_DATA_VALUE)
+                    bank = self.holding if fc == 3 else self.input
+                    values = self.get(bank, start, length)
+                    return struct.pack(f'>BB{length}H', fc, 2 * length, *values)
+                if fc in (1, 2):
+                    start, length = struct.unpack_from('>HH', pdu, 1)
+                    if not 1 <= length <= 2000:
+                        raise ModbusSlaveException(ILLEGAL_DATA_VALUE)
+                    bank = self.coils if fc == 1 else self.discrete
+                    data = bytearray((length + 7) // 8)
+                    for i, v in enumerate(self.get(bank, start, length)):
+                        if v:
+                            data[i >> 3] |= 1 << (i & 7)
+                    return bytes((fc, len(data))) + data
+                if fc == 5:
+                    start, value = struct.unpack_from('>HH', pdu, 1)
+                    if value not in (0, 0xFF00):
+                        raise ModbusSlaveException(ILLEGAL_DATA_VALUE)
+                    self.set(self.coils, start, [value == 0xFF00])
+                    return bytes(pdu[:5])
+                if fc == 15:
+                    start, length, n = struct.unpack_from('>HHB', pdu, 1)
+                    if n != (length + 7) // 8 or len(pdu) < 6 + n:
+                        raise ModbusSlaveException(ILLEGAL_DATA_VALUE)
+                    self.set(self.coils, start, [bool(pdu[6 + (i >> 3)] >> (i & 7) & 1) for i in range(length)])
+                    return bytes(pdu[:5])
+                if fc == 17:
+                    return bytes((fc, len(self.server_id) + 1)) + self.server_id + b'\xff'
+                if fc == 6:
+                    start, value = struct.unpack_from('>HH', pdu, 1)
+                    self.set(self.holding, start, [value])
+                    return bytes(pdu[:5])
+                if fc == 16:
+                    start, length, n = struct.unpack_from('>HHB', pdu, 1)
+                    if n != 2 * length or len(pdu) < 6 + n:
+                        raise ModbusSlaveException(ILLEGAL_DATA_VALUE)
+                    self.set(self.holding, start, struct.unpack_from(f'>{length}H', pdu, 6))
+                    return bytes(pdu[:5])
+                if fc == 23:
+                    r_start, r_length, w_start, w_length, n = struct.unpack_from('>HHHHB', pdu, 1)
+                    if n != 2 * w_length or len(pdu) < 10 + n:
+                        raise ModbusSlaveException(ILLEGAL_DATA_VALUE)
+                    self.set(self.holding, w_start, struct.unpack_from(f'>{w_length}H', pdu, 10))
+                    values = self.get(self.holding, r_start, r_length)
+                    return struct.pack(f'>BB{r_length}H', fc, 2 * r_length, *values)
+                raise ModbusSlaveException(ILLEGAL_FUNCTION)
+        except ModbusSlaveException as ex:
+            return bytes((fc | 0x80, ex.code))
+        except struct.error:
+            return bytes((fc | 0x80, ILLEGAL_DATA_VALUE))
+
+
+class ModbusEmulator:
+    """In-process Modbus RTU slaves on emulated line, usable as ComPort emulated class.
+
+    Slaves are shared by all emulator instances of the same port name.
+    Responses become readable byte by byte with timing derived from baudrate plus slave latency.
+    Faults are injected per address with set_fault().
+    """
+    _slaves = {}
+    _faults = {}
+    LATENCY = 0.001
+
+    def __init__(self, port: str, *args, **kwargs):
+        self.port = port
+        self.logger = kwargs.get('logger', config_logger())
+        baudrate = kwargs.get('baudrate', 115200)
+        # 11 bits per character: start, 8 data, parity or second stop, stop
+        self.char_time = 11.0 / baudrate if baudrate else 0.0
+        self.latency = kwargs.get('latency', ModbusEmulator.LATENCY)
+        # create slave for any address on first request
+        self.auto_slaves = kwargs.get('auto_slaves', True)
+        self.slaves = ModbusEmulator._slaves.setdefault(port, {})
+        self.faults = ModbusEmulator._faults.setdefault(port, {})
+        for addr, slave in kwargs.get('slaves', {}).items():
+            self.add_slave(addr, slave)
+        self.rx = bytearray()
+        # (receive time of first byte, response bytes)
+        self.tx = deque()
+        self.opened = True
+        self.lock = RLock()
+        self.requests = 0
+
+    def add_slave(self, addr: int, slave=None):
+        if slave is None:
+            slave = ModbusSlave()
+        elif isinstance(slave, dict):
+            slave = ModbusSlave(**slave)
+        self.slaves[int(addr)] = slave
+        return slave
+
+    def set_fault(self, addr: int, timeout: float = 0.0, bad_crc: float = 0.0, exception: int = None,
+                  exception_rate: float = 1.0):
+        # probabilities of no response and corrupted checksum, slave exception code returned with exception_rate
+        self.faults[int(addr)] = {'timeout': timeout, 'bad_crc': bad_crc,
+                                  'exception': exception, 'exception_rate': exception_rate}
+
+    def clear_fault(self, addr: int = None):
+        if addr is None:
+            self.faults.clear()
+        else:
+            self.faults.pop(int(addr), None)
+
+    def open(self):
+        self.opened = True
+        return True
+
+    def isOpen(self):
+        return self.opened
+
+    def close(self):
+        self.opened = False
+        return True
+
+    @property
+    def ready(self):
+        return self.opened
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.tx.clear()
+        return True
+
+    def reset_output_buffer(self):
+        return True
+
+    def write(self, data, *args, **kwargs):
+        now = time.perf_counter()
+        with self.lock:
+            self.rx += data
+            n = request_length(self.rx)
+            if n == 0 or (n > 0 and len(self.rx) < n):
+                # wait for the rest of request
+                return len(data)
+            # no silence inside data written at once, slaves take it as one frame
+            frame = bytes(self.rx)
+            self.rx.clear()
+            # end of request transmission
+            t = now + len(frame) * self.char_time
+            response = self.respond(frame)
+            if response:
+                # line is busy until previous response is transmitted
+                if self.tx:
+                    t0, r = self.tx[-1]
+                    t = max(t, t0 + len(r) * self.char_time)
+                # time when the first byte of response is received
+                self.tx.append((t + self.latency + self.char_time, response))
+        return len(data)
+
+    def respond(self, frame: bytes) -> bytes:
+        self.requests += 1
+        if modbus_crc(frame) != 0:
+            # slave ignores corrupted request
+            self.rx.clear()
+            return b''
+        addr = frame[0]
+        if addr == 0:
+            # broadcast, no response
+            for slave in list(self.slaves.values()):
+                slave.process(frame[1:-2])
+            return b''
+        slave = self.slaves.get(addr)
+        if slave is None:
+            if not self.auto_slaves:
+                return b''
+            slave = self.add_slave(addr)
+        fault = self.faults.get(addr)
+        if fault is not None:
+            if random.random() < fault['timeout']:
+                return b''
+            if fault['exception'] is not None and random.random() < fault['exception_rate']:
+                pdu = bytes((frame[1] | 0x80, fault['exception']))
+            else:
+                pdu = slave.process(frame[1:-2])
+        else:
+            pdu = slave.process(frame[1:-2])
+        response = bytes((addr,)) + pdu
+        crc = modbus_crc(response)
+        if fault is not None and random.random() < fault['bad_crc']:
+            crc ^= 0xFFFF
+        return response + crc.to_bytes(2, 'little')
+
+    def available(self, now=None) -> int:
+        if now is None:
+            now = time.perf_counter()
+        n = 0
+        for t0, r in self.tx:
+            if now < t0:
+                break
+            if self.char_time > 0.0:
+                k = min(len(r), int((now - t0) / self.char_time) + 1)
+            else:
+                k = len(r)
+            n += k
+            if k < len(r):
+                break
+        return n
+
+    def read(self, n=1, *args, **kwargs):
+        with self.lock:
+            k = min(n, self.available())
+            result = bytearray()
+            while k > 0 and self.tx:
+                t0, r = self.tx[0]
+                if len(r) <= k:
+                    result += r
+                    k -= len(r)
+                    self.tx.popleft()
+                else:
+                    result += r[:k]
+                    # remaining bytes continue at the same rate
+                    self.tx[0] = (t0 + k * self.char_time, r[k:])
+                    k = 0
+            return bytes(result)
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            return self.available()
+
+    def wait_readable(self, timeout):
+        # sleep until next byte arrives or timeout expires
+        with self.lock:
+            if not self.tx:
+                next_time = None
+            elif self.available() > 0:
+                return True
+            else:
+                next_time = self.tx[0][0]
+        now = time.perf_counter()
+        if next_time is None:
+            time.sleep(max(min(timeout, 0.001), 0.0))
+            return False
+        time.sleep(max(min(timeout, next_time - now), 0.0))
+        return self.in_waiting > 0
+
+
+if __name__ == "__main__":
+    from ModbusDevice import ModbusDevice
+
+    md = ModbusDevice('EMULATED1', 1, emulated=ModbusEmulator, baudrate=57600, init_sleep=0.0,
+                      slaves={1: {'holding': {4096 + i: i for i in range(18)}}})
+    t_0 = time.time()
+    print(md.modbus_read(4096, 18), md.error, '%4d ms' % int((time.time() - t_0) * 1000.0))
+    print(md.modbus_write(4105, [2222, 333]), md.modbus_read(4104, 3))
+    md.com.device.set_fault(1, exception=ILLEGAL_DATA_ADDRESS)
+    print(md.modbus_read(4096, 2), md.error)
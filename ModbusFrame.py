@@ -0,0 +1,82 @@
+import struct
+
+from ModbusCRC import modbus_crc
+
+MAX_FRAME = 256
+READ_HEADER = struct.Struct('>BBHH')
+WRITE_HEADER = struct.Struct('>BBHHB')
+WRITE_READ_HEADER = struct.Struct('>BBHHHHB')
+REGISTER = struct.Struct('>H')
+
+
+class ModbusFrameBuilder:
+    """Builds RTU request frames with checksum in reusable buffer.
+
+    Returned memoryview is valid until the next frame is built.
+    """
+
+    def __init__(self, size: int = MAX_FRAME):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def finish(self, n: int) -> memoryview:
+        if n + 2 > len(self.buffer):
+            raise ValueError(f'Frame length {n + 2} exceeds {len(self.buffer)}')
+        crc = modbus_crc(self.view[:n])
+        self.buffer[n] = crc & 0xFF
+        self.buffer[n + 1] = crc >> 8
+        return self.view[:n + 2]
+
+    def pack_data(self, offset: int, data) -> int:
+        # pack registers (int) or raw bytes to buffer at offset, returns end position
+        p = offset
+        limit = len(self.buffer) - 2
+        for d in data:
+            if isinstance(d, int):
+                if not 0 <= d <= 0xFFFF:
+                    raise ValueError(f'Register value {d} out of range 0..65535')
+                n = 2
+            elif isinstance(d, (bytes, bytearray, memoryview)):
+                n = len(d)
+            else:
+                raise ValueError('Wrong data format for write')
+            if p + n > limit:
+                raise ValueError('Data does not fit in frame')
+            if isinstance(d, int):
+                REGISTER.pack_into(self.buffer, p, d)
+            else:
+                self.buffer[p:p + n] = d
+            p += n
+        return p
+
+    def simple_request(self, addr: int, command: int) -> memoryview:
+        # request without data, e.g. report server id (17)
+        self.buffer[0] = addr
+        self.buffer[1] = command
+        return self.finish(2)
+
+    def read_request(self, addr: int, command: int, start: int, length: int) -> memoryview:
+        READ_HEADER.pack_into(self.buffer, 0, addr, command, start, length)
+        return self.finish(READ_HEADER.size)
+
+    def write_request(self, addr: int, command: int, start: int, data) -> memoryview:
+        p = self.pack_data(WRITE_HEADER.size, data)
+        n = p - WRITE_HEADER.size
+        WRITE_HEADER.pack_into(self.buffer, 0, addr, command, start, n // 2, n)
+        return self.finish(p)
+
+    def write_bits_request(self, addr: int, command: int, start: int, count: int, data) -> memoryview:
+        # data is packed coil bytes
+        if WRITE_HEADER.size + len(data) > len(self.buffer) - 2:
+            raise ValueError('Data does not fit in frame')
+        self.buffer[WRITE_HEADER.size:WRITE_HEADER.size + len(data)] = data
+        WRITE_HEADER.pack_into(self.buffer, 0, addr, command, start, count, len(data))
+        return self.finish(WRITE_HEADER.size + len(data))
+
+    def write_read_request(self, addr: int, read_start: int, read_length: int, write_start: int, data,
+                           command: int = 23) -> memoryview:
+        p = self.pack_data(WRITE_READ_HEADER.size, data)
+        n = p - WRITE_READ_HEADER.size
+        WRITE_READ_HEADER.pack_into(self.buffer, 0, addr, command, read_start, read_length,
+                                    write_start, n // 2, n)
+        return self.finish(p)
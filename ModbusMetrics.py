@@ -0,0 +1,106 @@
+import bisect
+import time
+from threading import Lock
+
+# upper bounds of latency histogram bins, s, the last bin counts longer transactions
+LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+# ModbusDevice error codes, lower codes are slave exceptions
+ERROR_NAMES = {
+    257: 'wrong address',
+    258: 'wrong command',
+    259: 'timeout',
+    260: 'address or byte count mismatch',
+    261: 'unexpected op code',
+    262: 'not ready',
+    263: 'port error',
+}
+
+
+def error_name(code: int) -> str:
+    if code < 256:
+        return f'slave exception {code}'
+    return ERROR_NAMES.get(code, f'error {code}')
+
+
+class ModbusMetrics:
+    """Transaction counters and latency histogram of Modbus device or port.
+
+    record() is called for each transaction, snapshot() returns consistent copy for attributes and benchmarks.
+    """
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.transactions = 0
+            self.bytes_out = 0
+            self.bytes_in = 0
+            # error code: count, slave exception codes are below 256
+            self.errors = {}
+            self.timeouts = 0
+            self.retries = 0
+            self.histogram = [0] * (len(LATENCY_BINS) + 1)
+            self.latency_sum = 0.0
+            self.latency_max = 0.0
+
+    def record(self, latency: float, bytes_out: int = 0, bytes_in: int = 0, error: int = 0):
+        with self.lock:
+            self.transactions += 1
+            self.bytes_out += bytes_out
+            self.bytes_in += bytes_in
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                if error == 259:
+                    self.timeouts += 1
+            self.histogram[bisect.bisect_left(LATENCY_BINS, latency)] += 1
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def percentile(self, q: float) -> float:
+        # upper bound of histogram bin containing q-th percentile (0..100)
+        with self.lock:
+            n = self.transactions
+            histogram = list(self.histogram)
+            latency_max = self.latency_max
+        if n == 0:
+            return 0.0
+        k = q / 100.0 * n
+        s = 0
+        for bound, count in zip(LATENCY_BINS, histogram):
+            s += count
+            if s >= k:
+                return min(bound, latency_max)
+        return latency_max
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = time.time() - self.started
+            n = self.transactions
+            errors = sum(self.errors.values())
+            return {
+                'name': self.name,
+                'elapsed': elapsed,
+                'transactions': n,
+                'rate': n / elapsed if elapsed > 0.0 else 0.0,
+                'bytes_out': self.bytes_out,
+                'bytes_in': self.bytes_in,
+                'errors': errors,
+                'error_rate': errors / n if n else 0.0,
+                'error_codes': dict(self.errors),
+                'error_names': {error_name(code): count for code, count in self.errors.items()},
+                'timeouts': self.timeouts,
+                'retries': self.retries,
+                'latency_mean': self.latency_sum / n if n else 0.0,
+                'latency_max': self.latency_max,
+                'latency_bins': LATENCY_BINS,
+                'latency_histogram': list(self.histogram),
+            }
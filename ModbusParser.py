@@ -0,0 +1,136 @@
+from ModbusCRC import modbus_crc
+
+REQUEST = 'request'
+RESPONSE = 'response'
+AUTO = 'auto'
+MIN_FRAME = 4
+MAX_FRAME = 256
+
+
+def request_length(buf) -> int:
+    # expected RTU request length from header, 0 if more bytes needed, -1 for unknown function
+    if len(buf) < 2:
+        return 0
+    fc = buf[1]
+    if fc in (1, 2, 3, 4, 5, 6, 8):
+        return 8
+    if fc in (7, 11, 12, 17):
+        return 4
+    if fc in (15, 16):
+        return 9 + buf[6] if len(buf) >= 7 else 0
+    if fc == 23:
+        return 13 + buf[10] if len(buf) >= 11 else 0
+    return -1
+
+
+def response_length(buf) -> int:
+    # expected RTU response length from header, 0 if more bytes needed, -1 for unknown function
+    if len(buf) < 2:
+        return 0
+    fc = buf[1]
+    if fc & 0x80:
+        return 5
+    if fc in (5, 6, 8, 11, 15, 16):
+        return 8
+    if fc == 7:
+        return 5
+    if fc in (1, 2, 3, 4, 12, 17, 23):
+        return 5 + buf[2] if len(buf) >= 3 else 0
+    return -1
+
+
+class ModbusRTUParser:
+    """Incremental Modbus RTU frame parser.
+
+    feed() accepts arbitrary chunks and returns complete frames with valid checksum.
+    Frame boundaries are found from header length rules and confirmed by CRC,
+    on noise the parser drops bytes until a valid frame is found.
+    flush() is called at line silence (frame end), it finds frames behind
+    noise claiming a long length and drops the rest.
+    mode is 'response', 'request' or 'auto' (both, for passive bus monitors).
+    """
+
+    def __init__(self, mode: str = RESPONSE, addresses=None):
+        if mode == REQUEST:
+            self.rules = (request_length,)
+        elif mode == RESPONSE:
+            self.rules = (response_length,)
+        else:
+            self.rules = (request_length, response_length)
+        self.mode = mode
+        # accepted slave addresses, None for any
+        self.addresses = None if addresses is None else set(addresses)
+        self.buffer = bytearray()
+        self.frames = 0
+        self.discarded = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self.buffer)
+
+    def clear(self):
+        self.discarded += len(self.buffer)
+        self.buffer.clear()
+
+    def match(self, pos: int):
+        # (frame length, need more bytes) for frame starting at pos
+        buf = self.buffer
+        if self.addresses is not None and buf[pos] not in self.addresses:
+            return 0, False
+        more = False
+        view = memoryview(buf)[pos:]
+        try:
+            for rule in self.rules:
+                n = rule(view)
+                if n == 0:
+                    more = True
+                elif MIN_FRAME <= n <= MAX_FRAME:
+                    if len(view) < n:
+                        more = True
+                    elif modbus_crc(view[:n]) == 0:
+                        return n, False
+        finally:
+            view.release()
+        return 0, more
+
+    def feed(self, data) -> list:
+        if data:
+            self.buffer += data
+        frames = []
+        while len(self.buffer) >= MIN_FRAME:
+            n, more = self.match(0)
+            if n > 0:
+                frames.append(bytes(self.buffer[:n]))
+                del self.buffer[:n]
+                self.frames += 1
+                continue
+            if more:
+                break
+            # resynchronize
+            del self.buffer[0]
+            self.discarded += 1
+        return frames
+
+    def flush(self) -> list:
+        frames = []
+        pos = 0
+        while pos <= len(self.buffer) - MIN_FRAME:
+            n = self.match(pos)[0]
+            if n > 0:
+                frames.append(bytes(self.buffer[pos:pos + n]))
+                self.discarded += pos
+                del self.buffer[:pos + n]
+                self.frames += 1
+                pos = 0
+            else:
+                pos += 1
+        self.clear()
+        return frames
+
+    def expected_length(self) -> int:
+        # expected length of buffered partial frame, 0 if unknown
+        for rule in self.rules:
+            n = rule(self.buffer)
+            if n > 0:
+                return n
+        return 0
@@ -0,0 +1,139 @@
+import time
+from threading import RLock
+
+MAX_READ_REGISTERS = 125
+
+
+def coalesce(ranges, gap: int = 0, max_length: int = MAX_READ_REGISTERS):
+    # merge (start, length) ranges into minimal list of blocks not longer than max_length,
+    # ranges separated by not more than gap unused registers are merged
+    blocks = []
+    for start, length in sorted((int(s), int(n)) for s, n in ranges if n > 0):
+        end = start + length
+        if blocks:
+            b_start, b_end = blocks[-1]
+            if start <= b_end + gap and end - b_start <= max_length:
+                blocks[-1] = (b_start, max(b_end, end))
+                continue
+            if start < b_end:
+                # overlaps full block, continue after it
+                start = b_end
+        while end - start > max_length:
+            blocks.append((start, start + max_length))
+            start += max_length
+        if end > start:
+            blocks.append((start, end))
+    return [(s, e - s) for s, e in blocks]
+
+
+class ModbusRegisterCache:
+    """Register map cache for ModbusDevice, coalesces reads and serves values within TTL"""
+    GAP = 8
+    TTL = 0.5
+
+    def __init__(self, device, gap: int = GAP, ttl: float = TTL, max_length: int = MAX_READ_REGISTERS):
+        self.device = device
+        self.gap = gap
+        self.ttl = ttl
+        self.max_length = max_length
+        self.lock = RLock()
+        # per command: registered ranges, register ttl, values and expiration times
+        self.ranges = {}
+        self.register_ttl = {}
+        self.values = {}
+        self.expires = {}
+        self.blocks = {}
+        self.reads = 0
+        self.hits = 0
+        # incremented by invalidate, reads started before it are not marked fresh
+        self.generation = 0
+        # invalidate on device writes
+        device.register_cache = self
+
+    def add_range(self, start: int, length: int = 1, ttl: float = None, command: int = 3):
+        if ttl is None:
+            ttl = self.ttl
+        with self.lock:
+            self.ranges.setdefault(command, []).append((start, length))
+            rt = self.register_ttl.setdefault(command, {})
+            for a in range(start, start + length):
+                rt[a] = min(rt.get(a, ttl), ttl)
+            self.blocks[command] = coalesce(self.ranges[command], self.gap, self.max_length)
+
+    def plan(self, command: int = 3):
+        with self.lock:
+            return list(self.blocks.get(command, []))
+
+    def fresh(self, start: int, length: int = 1, command: int = 3) -> bool:
+        now = time.time()
+        expires = self.expires.get(command, {})
+        for a in range(start, start + length):
+            if expires.get(a, 0.0) <= now:
+                return False
+        return True
+
+    def read_block(self, start: int, length: int, command: int = 3) -> bool:
+        # device I/O runs without cache lock, device writes invalidate cache holding device lock
+        with self.lock:
+            generation = self.generation
+        data = self.device.modbus_read(start, length, command=command)
+        with self.lock:
+            self.reads += 1
+            if len(data) != length:
+                return False
+            now = time.time()
+            values = self.values.setdefault(command, {})
+            expires = self.expires.setdefault(command, {})
+            rt = self.register_ttl.get(command, {})
+            for i, v in enumerate(data):
+                a = start + i
+                values[a] = v
+                # block invalidated during read may be stale, it is not marked fresh
+                if generation == self.generation:
+                    expires[a] = now + rt.get(a, self.ttl)
+        return True
+
+    def refresh(self, command: int = None, force: bool = False) -> bool:
+        # read expired blocks of registered ranges
+        result = True
+        with self.lock:
+            commands = list(self.blocks) if command is None else [command]
+            blocks = [(s, n, c) for c in commands for s, n in self.blocks.get(c, [])
+                      if force or not self.fresh(s, n, c)]
+        for start, length, c in blocks:
+            result = self.read_block(start, length, c) and result
+        return result
+
+    def read(self, start: int, length: int = 1, command: int = 3):
+        with self.lock:
+            if self.fresh(start, length, command):
+                self.hits += 1
+                values = self.values.get(command, {})
+                return [values[a] for a in range(start, start + length)]
+            end = start + length
+            blocks = [b for b in self.blocks.get(command, []) if b[0] < end and b[0] + b[1] > start]
+            covered = set()
+            for b_start, b_length in blocks:
+                covered.update(range(b_start, b_start + b_length))
+            if any(a not in covered for a in range(start, end)):
+                # range is not registered, read it directly
+                blocks = coalesce([(start, length)], 0, self.max_length)
+            blocks = [b for b in blocks if not self.fresh(b[0], b[1], command)]
+        for b_start, b_length in blocks:
+            if not self.read_block(b_start, b_length, command):
+                return []
+        with self.lock:
+            values = self.values.get(command, {})
+            return [values[a] for a in range(start, start + length)]
+
+    def invalidate(self, start: int = None, length: int = 1, command: int = None):
+        with self.lock:
+            self.generation += 1
+            commands = list(self.expires) if command is None else [command]
+            for c in commands:
+                expires = self.expires.get(c, {})
+                if start is None:
+                    expires.clear()
+                    continue
+                for a in range(start, start + length):
+                    expires.pop(a, None)
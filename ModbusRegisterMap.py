@@ -0,0 +1,215 @@
+import struct
+from dataclasses import dataclass, asdict, fields
+
+import numpy
+
+from Configuration import Configuration
+from ModbusDecode import DTYPES, WORD_ORDERS, register_count
+from ModbusRegisterCache import MAX_READ_REGISTERS
+
+# struct format codes of register data types
+STRUCT_CODES = {
+    'int16': 'h',
+    'uint16': 'H',
+    'int32': 'i',
+    'uint32': 'I',
+    'float32': 'f',
+    'int64': 'q',
+    'uint64': 'Q',
+    'float64': 'd',
+}
+
+
+@dataclass
+class Register:
+    """Register map entry, engineering value = raw * scale + offset"""
+    name: str
+    address: int
+    type: str = 'uint16'
+    scale: float = 1.0
+    offset: float = 0.0
+    word_order: str = 'big'
+    command: int = 3
+
+    def __post_init__(self):
+        if self.type not in STRUCT_CODES:
+            raise ValueError(f'Wrong register type {self.type} for {self.name}')
+        if self.word_order not in WORD_ORDERS:
+            raise ValueError(f'Wrong word order {self.word_order} for {self.name}')
+        if self.command not in (3, 4):
+            raise ValueError(f'Wrong read command {self.command} for {self.name}')
+
+    @property
+    def length(self) -> int:
+        return register_count(self.type)
+
+    @property
+    def scaled(self) -> bool:
+        return self.scale != 1.0 or self.offset != 0.0
+
+
+class _Group:
+    # non overlapping registers of one block decoded by single Struct
+    def __init__(self, block_start: int, registers):
+        code = '>'
+        p = block_start
+        self.slots = []
+        index = 0
+        for r in registers:
+            if r.address > p:
+                code += f'{2 * (r.address - p)}x'
+            if r.word_order == 'big' or r.length == 1:
+                code += STRUCT_CODES[r.type]
+                self.slots.append((r, index, 0, None))
+                index += 1
+            else:
+                # least significant word first, words are swapped after unpack
+                code += f'{r.length}H'
+                swap = (struct.Struct(f'>{r.length}H'), struct.Struct('>' + STRUCT_CODES[r.type]))
+                self.slots.append((r, index, r.length, swap))
+                index += r.length
+            p = r.address + r.length
+        self.struct = struct.Struct(code)
+
+    def decode(self, buffer, result: dict):
+        raw = self.struct.unpack_from(buffer, 0)
+        for r, index, n, swap in self.slots:
+            if swap is None:
+                v = raw[index]
+            else:
+                v = swap[1].unpack(swap[0].pack(*reversed(raw[index:index + n])))[0]
+            if r.scaled:
+                v = v * r.scale + r.offset
+            result[r.name] = v
+
+
+class ModbusRegisterMap:
+    """Declarative register map compiled to read plan and struct decoders.
+
+    Registers are given as Register objects or dicts with the same keys,
+    read_all() reads coalesced blocks and returns engineering values by name.
+    """
+    GAP = 8
+
+    def __init__(self, registers=(), device=None, gap: int = GAP, max_length: int = MAX_READ_REGISTERS):
+        self.device = device
+        self.gap = gap
+        self.max_length = max_length
+        self.registers = {}
+        for r in registers:
+            self.add(r)
+        self.plan = []
+        self.dtype = None
+        self.compiled = False
+        # failed blocks of the last read_all
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        # config is Configuration, dict or file name with 'registers' list
+        if not isinstance(config, dict):
+            config = Configuration(config)
+        kwargs.setdefault('gap', config.get('gap', cls.GAP))
+        return cls(config.get('registers', []), **kwargs)
+
+    def to_config(self, file_name=None) -> Configuration:
+        config = Configuration(file_name)
+        config['gap'] = self.gap
+        config['registers'] = [asdict(r) for r in self.registers.values()]
+        if file_name:
+            config.write()
+        return config
+
+    def add(self, register):
+        if isinstance(register, dict):
+            names = {f.name for f in fields(Register)}
+            register = Register(**{k: v for k, v in register.items() if k in names})
+        if register.name in self.registers:
+            raise ValueError(f'Duplicated register name {register.name}')
+        self.registers[register.name] = register
+        self.compiled = False
+        return register
+
+    def blocks(self, registers) -> list:
+        # (start, length, registers) read blocks, registers are never split between blocks,
+        # registers separated by not more than gap unused registers are merged
+        blocks = []
+        for r in registers:
+            if r.length > self.max_length:
+                raise ValueError(f'Register {r.name} is longer than {self.max_length} registers')
+            end = r.address + r.length
+            if blocks:
+                start, b_end, inside = blocks[-1]
+                if r.address <= b_end + self.gap and end - start <= self.max_length:
+                    inside.append(r)
+                    blocks[-1] = (start, max(b_end, end), inside)
+                    continue
+            blocks.append((r.address, end, [r]))
+        return [(start, end - start, inside) for start, end, inside in blocks]
+
+    def compile(self):
+        # plan: list of (command, start, length, groups)
+        plan = []
+        by_command = {}
+        for r in self.registers.values():
+            by_command.setdefault(r.command, []).append(r)
+        for command, registers in sorted(by_command.items()):
+            registers.sort(key=lambda r: (r.address, r.length))
+            planned = 0
+            for start, length, inside in self.blocks(registers):
+                planned += len(inside)
+                groups = []
+                while inside:
+                    group = []
+                    p = start
+                    rest = []
+                    for r in inside:
+                        if r.address >= p:
+                            group.append(r)
+                            p = r.address + r.length
+                        else:
+                            rest.append(r)
+                    groups.append(_Group(start, group))
+                    inside = rest
+                plan.append((command, start, length, groups))
+            if planned != len(registers):
+                raise ValueError(f'{len(registers) - planned} registers of command {command} are not in read plan')
+        self.plan = plan
+        self.dtype = numpy.dtype([(r.name, 'f8' if r.scaled else DTYPES[r.type].replace('>', '<'))
+                                  for r in self.registers.values()])
+        self.compiled = True
+        return plan
+
+    def transactions(self) -> int:
+        if not self.compiled:
+            self.compile()
+        return len(self.plan)
+
+    def read_all(self, device=None, output='dict'):
+        """Read all registers with minimal number of transactions.
+
+        Returns dict of name: value (None for failed blocks) or numpy record (output='record',
+        failed values are NaN or 0).
+        """
+        if device is None:
+            device = self.device
+        if not self.compiled:
+            self.compile()
+        result = dict.fromkeys(self.registers)
+        self.errors = 0
+        for command, start, length, groups in self.plan:
+            data = device.modbus_read(start, length, command=command, output='memoryview')
+            if len(data) < 2 * length:
+                self.errors += 1
+                continue
+            for g in groups:
+                g.decode(data, result)
+        if output == 'record':
+            record = numpy.zeros(1, dtype=self.dtype)[0]
+            for name, v in result.items():
+                if v is not None:
+                    record[name] = v
+                elif record.dtype[name].kind == 'f':
+                    record[name] = numpy.nan
+            return record
+        return result
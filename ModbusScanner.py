@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Modbus RTU address scanner.
+Probes address ranges on several ports in parallel, one worker per port, and builds bus map:
+    python ModbusScanner.py COM3 COM4 --baudrate 19200 --identify --output devices.json
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+
+from ComPort import ComPort
+from Configuration import Configuration
+from ModbusFrame import ModbusFrameBuilder
+from ModbusParser import ModbusRTUParser, RESPONSE
+from config_logger import config_logger
+from log_exception import log_exception
+
+APPLICATION_NAME = 'Modbus RTU address scanner'
+APPLICATION_NAME_SHORT = 'ModbusScanner'
+APPLICATION_VERSION = '1.0'
+
+MAX_ADDRESS = 247
+
+
+class ModbusScanner:
+    """Parallel scan of Modbus addresses, results are collected to bus map {port: {addr: info}}.
+
+    Address is alive if it answers probe read by any valid frame, slave exception included.
+    """
+    TIMEOUT = 0.05
+    REPORT_ID = 17
+
+    def __init__(self, ports, addresses=range(1, MAX_ADDRESS + 1), timeout: float = TIMEOUT,
+                 register: int = 0, identify: bool = False, **kwargs):
+        self.ports = [str(p).strip() for p in ports]
+        self.addresses = [int(a) for a in addresses if 1 <= int(a) <= MAX_ADDRESS]
+        # per probe response timeout, transmission time is added from baudrate
+        self.timeout = timeout
+        # holding register read by probe
+        self.register = register
+        # read server id (function 17) of found devices
+        self.identify = identify
+        self.logger = kwargs.get('logger', config_logger())
+        # additional arguments for ComPort creation
+        self.kwargs = kwargs
+        self.bus_map = {}
+        self.probes = 0
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def stop(self):
+        self.stopped.set()
+
+    def scan(self) -> dict:
+        self.stopped.clear()
+        threads = [threading.Thread(target=self.scan_port, args=(p,), name=f'ModbusScanner {p}', daemon=True)
+                   for p in self.ports]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.bus_map
+
+    def scan_port(self, port: str) -> dict:
+        found = {}
+        with self.lock:
+            self.bus_map[port] = found
+        com = ComPort(port, **self.kwargs)
+        try:
+            if not com.ready:
+                self.logger.info(f'{port} Port is not ready, skipped')
+                return found
+            baudrate = self.kwargs.get('baudrate', 0)
+            char_time = 11.0 / baudrate if baudrate else 0.0
+            builder = ModbusFrameBuilder()
+            parser = ModbusRTUParser(RESPONSE)
+            for addr in self.addresses:
+                if self.stopped.is_set():
+                    break
+                frame, dt = self.transact(com, parser, builder.read_request(addr, 3, self.register, 1),
+                                          addr, char_time)
+                if frame is None:
+                    continue
+                info = {'response_time': dt}
+                if frame[1] & 0x80:
+                    info['exception'] = frame[2]
+                if self.identify:
+                    frame, _ = self.transact(com, parser, builder.simple_request(addr, self.REPORT_ID),
+                                             addr, char_time)
+                    if frame is not None and frame[1] == self.REPORT_ID:
+                        info['id'] = bytes(frame[3:3 + frame[2]]).hex()
+                found[addr] = info
+                self.logger.debug(f'{port} Address {addr} answered in {dt * 1000.0:.1f} ms')
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{port} Scan exception')
+        finally:
+            com.close()
+        return found
+
+    def transact(self, com, parser, request, addr: int, char_time: float):
+        # (response frame or None, response time)
+        with com.lock:
+            com.reset_input_buffer()
+            parser.addresses = {addr}
+            parser.clear()
+            self.probes += 1
+            t_0 = time.perf_counter()
+            com.write(request)
+            deadline = t_0 + len(request) * char_time + self.timeout
+            while True:
+                data = com.read(1000)
+                now = time.perf_counter()
+                if data:
+                    for frame in parser.feed(data):
+                        return frame, now - t_0
+                    n = parser.expected_length()
+                    if n > 0:
+                        # rest of frame arrives at line rate
+                        deadline = max(deadline, now + (n - parser.pending) * char_time + self.timeout)
+                if now >= deadline:
+                    return None, now - t_0
+                com.wait_readable(deadline - now)
+
+
+def to_config(bus_map: dict, file_name=None, **kwargs) -> Configuration:
+    # device configuration {'devices': {'port:addr': {'port': port, 'addr': addr, ...}}} from bus map,
+    # kwargs are port parameters (baudrate, parity ...) added to each device
+    config = Configuration(file_name)
+    devices = config.get('devices', {})
+    for port, found in bus_map.items():
+        for addr, info in sorted(found.items()):
+            d = dict(kwargs, port=port, addr=addr)
+            if 'id' in info:
+                d['id'] = info['id']
+            devices[f'{port}:{addr}'] = d
+    config['devices'] = devices
+    if file_name:
+        config.write()
+    return config
+
+
+def address_list(value):
+    # '1-10,20,30-32'
+    result = []
+    for v in value.split(','):
+        if '-' in v:
+            a, b = v.split('-')
+            result.extend(range(int(a), int(b) + 1))
+        elif v.strip():
+            result.append(int(v))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=APPLICATION_NAME)
+    parser.add_argument('ports', nargs='+', help='ports to scan')
+    parser.add_argument('--addresses', type=address_list, default=list(range(1, MAX_ADDRESS + 1)),
+                        help='address ranges, e.g. 1-10,20')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--parity', default='N')
+    parser.add_argument('--timeout', type=float, default=ModbusScanner.TIMEOUT, help='probe timeout, s')
+    parser.add_argument('--register', type=int, default=0, help='holding register read by probe')
+    parser.add_argument('--identify', action='store_true', help='read server id of found devices')
+    parser.add_argument('--output', default='', help='device configuration file')
+    args = parser.parse_args()
+
+    logger = config_logger(name=APPLICATION_NAME_SHORT, level=logging.INFO)
+    t_0 = time.time()
+    scanner = ModbusScanner(args.ports, args.addresses, args.timeout, args.register, args.identify,
+                            baudrate=args.baudrate, parity=args.parity, logger=logger)
+    bus_map = scanner.scan()
+    for port, found in bus_map.items():
+        print(port, json.dumps({a: found[a] for a in sorted(found)}))
+    print('%d probes in %.1f s' % (scanner.probes, time.time() - t_0))
+    if args.output:
+        to_config(bus_map, args.output, baudrate=args.baudrate, parity=args.parity)
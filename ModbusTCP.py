@@ -0,0 +1,191 @@
+import struct
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from _socket import timeout
+
+from ModbusCRC import modbus_crc
+from Moxa import MoxaTCPComPort, PortNotOpenError
+from log_exception import log_exception
+
+MBAP = struct.Struct('>HHHB')
+PREFIX = 'mbtcp://'
+
+
+class ModbusTCPComPort(MoxaTCPComPort):
+    """Native Modbus TCP transport, MBAP framing with pipelined transactions matched by id.
+
+    transact() submits request PDU and returns Future with (unit, pdu) response.
+    write() and read() keep RTU compatible interface: frames written with CRC
+    are sent as MBAP requests and responses are read back with CRC appended.
+    """
+    DEFAULT_PORT = 502
+    READER_TIMEOUT = 0.5
+    MAX_PENDING = 16
+    # wait for free slot in transaction window
+    WINDOW_TIMEOUT = 1.0
+
+    def __init__(self, host: str, port: int = None, **kwargs):
+        host = host.strip()
+        if host.lower().startswith(PREFIX):
+            host = host[len(PREFIX):]
+        if port is None:
+            port = ModbusTCPComPort.DEFAULT_PORT
+        self.lock = threading.RLock()
+        self.rx_condition = threading.Condition()
+        self.rx = bytearray()
+        self.pending = {}
+        # futures of requests written by RTU compatible write(), one response is awaited at a time
+        self.rtu_pending = []
+        self.tid = 0
+        self.reader = None
+        self.window = threading.BoundedSemaphore(kwargs.get('max_pending', ModbusTCPComPort.MAX_PENDING))
+        super().__init__(host, port, **kwargs)
+        self.pre = f'MBTCP {self.host}:{self.port}'
+
+    def open(self):
+        super().open()
+        if self.socket is None:
+            return
+        self.socket.settimeout(self.kwargs.get('reader_timeout', ModbusTCPComPort.READER_TIMEOUT))
+        self.reader = threading.Thread(target=self.read_loop, args=(self.socket,),
+                                       name=f'MBTCP reader {self.host}:{self.port}', daemon=True)
+        self.reader.start()
+
+    def close(self):
+        result = super().close()
+        self.fail_pending()
+        return result
+
+    def transact(self, unit: int, pdu: bytes) -> Future:
+        if not self.isOpen():
+            raise PortNotOpenError()
+        if not self.window.acquire(timeout=self.kwargs.get('window_timeout', ModbusTCPComPort.WINDOW_TIMEOUT)):
+            raise FutureTimeoutError(f'{self.pre} Transaction window is full')
+        future = Future()
+        with self.lock:
+            self.tid = (self.tid + 1) & 0xFFFF
+            tid = self.tid
+            self.pending[tid] = future
+            future.add_done_callback(lambda f: self.release(tid))
+            try:
+                self.socket.sendall(MBAP.pack(tid, 0, len(pdu) + 1, unit) + bytes(pdu))
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(self.logger, f'{self.pre} Write error')
+                self.error = True
+                future.cancel()
+                raise
+        return future
+
+    def release(self, tid):
+        with self.lock:
+            if self.pending.pop(tid, None) is not None:
+                self.window.release()
+
+    def fail_pending(self):
+        with self.lock:
+            futures = list(self.pending.values())
+        for f in futures:
+            if not f.done():
+                f.set_exception(PortNotOpenError())
+
+    def read_loop(self, sock):
+        buf = bytearray()
+        while self.socket is sock:
+            try:
+                chunk = sock.recv(4096)
+            except timeout:
+                continue
+            except KeyboardInterrupt:
+                raise
+            except:
+                if self.socket is sock:
+                    log_exception(self.logger, f'{self.pre} Read error')
+                    self.error = True
+                break
+            if not chunk:
+                if self.socket is sock:
+                    self.logger.info(f'{self.pre} Connection closed by peer')
+                    self.error = True
+                break
+            buf += chunk
+            while len(buf) >= MBAP.size:
+                tid, pid, length, unit = MBAP.unpack_from(buf)
+                if len(buf) < 6 + length:
+                    break
+                pdu = bytes(buf[MBAP.size:6 + length])
+                del buf[:6 + length]
+                with self.lock:
+                    future = self.pending.get(tid)
+                if future is None or future.done():
+                    self.logger.debug(f'{self.pre} Unexpected transaction id {tid}')
+                    continue
+                future.set_result((unit, pdu))
+        if self.socket is sock:
+            # closed connection is not open, next transaction fails at once and port is reopened
+            self.close()
+            self.error = True
+        self.fail_pending()
+
+    # RTU compatible interface
+    def write(self, cmd):
+        cmd = bytes(cmd)
+        # new request abandons unanswered previous one, its window slot is freed
+        self.cancel_rtu()
+        future = self.transact(cmd[0], cmd[1:-2])
+        future.add_done_callback(self.rtu_response)
+        with self.lock:
+            self.rtu_pending.append(future)
+        return len(cmd)
+
+    def cancel_rtu(self):
+        with self.lock:
+            futures = self.rtu_pending
+            self.rtu_pending = []
+        for f in futures:
+            f.cancel()
+
+    def rtu_response(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        unit, pdu = future.result()
+        frame = bytes((unit,)) + pdu
+        with self.rx_condition:
+            self.rx += frame + modbus_crc(frame).to_bytes(2, 'little')
+            self.rx_condition.notify_all()
+
+    def read(self, n=1, timeout_break=False):
+        if not self.isOpen():
+            raise PortNotOpenError()
+        with self.rx_condition:
+            data = bytes(self.rx[:n])
+            del self.rx[:n]
+        return data
+
+    def readinto(self, buffer, timeout_break=False) -> int:
+        if not self.isOpen():
+            raise PortNotOpenError()
+        with self.rx_condition:
+            n = min(len(buffer), len(self.rx))
+            buffer[:n] = memoryview(self.rx)[:n]
+            del self.rx[:n]
+        return n
+
+    def wait_readable(self, timeout):
+        with self.rx_condition:
+            if len(self.rx) > 0:
+                return True
+            self.rx_condition.wait(timeout)
+            return len(self.rx) > 0
+
+    def reset_input_buffer(self):
+        self.cancel_rtu()
+        with self.rx_condition:
+            self.rx.clear()
+        return True
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
@@ -110,9 +110,31 @@ class MoxaTCPComPort:
             self.error = True
             raise
 
+    def readinto(self, buffer, timeout_break=False) -> int:
+        # receive to caller buffer without intermediate bytes object, 0 if nothing received before timeout
+        if not self.isOpen():
+            raise PortNotOpenError()
+        try:
+            return self.socket.recv_into(buffer)
+        except KeyboardInterrupt:
+            raise
+        except timeout:
+            if timeout_break:
+                raise
+            return 0
+        except:
+            log_exception(self.logger, f'{self.pre} Read error')
+            self.error = True
+            raise
+
     def isOpen(self):
         return self.socket is not None
 
+    def fileno(self):
+        if not self.isOpen():
+            raise PortNotOpenError()
+        return self.socket.fileno()
+
     def reset_input_buffer(self):
         b = self.read(1000)
         b1 = b'' + b
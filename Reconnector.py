@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+
+def backoff_delay(base: float, attempt: int, max_delay: float, jitter: float = 0.2) -> float:
+    # exponential backoff with random jitter
+    delay = min(base * (2 ** min(attempt, 32)), max_delay)
+    return delay * random.uniform(1.0 - jitter, 1.0 + jitter)
+
+
+class Reconnector:
+    """Background workers running scheduled reconnect calls outside of I/O threads.
+
+    Up to WORKERS calls run in parallel, so slow port opens do not delay probes of other devices.
+    Calls with the same key never run concurrently.
+    """
+    WORKERS = 4
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, logger=None, workers: int = WORKERS):
+        self.logger = logger if logger is not None else config_logger()
+        self.workers = max(int(workers), 1)
+        self.queue = []
+        self.keys = {}
+        # keys of running calls and calls due while the same key is running
+        self.running = set()
+        self.deferred = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.idle = 0
+
+    def schedule(self, func, key=None, delay: float = 0.0) -> bool:
+        # call func after delay, one pending call per key
+        if key is None:
+            key = func
+        with self.condition:
+            if key in self.keys:
+                return False
+            n = next(self.counter)
+            self.keys[key] = n
+            heapq.heappush(self.queue, (time.time() + delay, n, key, func))
+            self.threads = [t for t in self.threads if t.is_alive()]
+            if self.idle == 0 and len(self.threads) < self.workers:
+                t = threading.Thread(target=self.run, name=f'Reconnector {len(self.threads)}', daemon=True)
+                self.threads.append(t)
+                t.start()
+            self.condition.notify()
+        return True
+
+    def cancel(self, key) -> bool:
+        with self.condition:
+            self.deferred.pop(key, None)
+            return self.keys.pop(key, None) is not None
+
+    def scheduled(self, key) -> bool:
+        with self.condition:
+            return key in self.keys
+
+    def next_call(self):
+        # called with condition locked, waits for due call
+        while True:
+            if not self.queue:
+                self.condition.wait()
+                continue
+            t, n, key, func = self.queue[0]
+            dt = t - time.time()
+            if dt > 0.0:
+                self.condition.wait(dt)
+                continue
+            heapq.heappop(self.queue)
+            # skip cancelled calls, running call may schedule the next one with the same key
+            if self.keys.get(key) != n:
+                continue
+            if key in self.running:
+                # started when running call of the key returns
+                self.deferred[key] = (n, func)
+                continue
+            del self.keys[key]
+            self.running.add(key)
+            return key, func
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.idle += 1
+                try:
+                    key, func = self.next_call()
+                finally:
+                    self.idle -= 1
+            try:
+                func()
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(self.logger, 'Reconnect exception')
+            finally:
+                with self.condition:
+                    self.running.discard(key)
+                    deferred = self.deferred.pop(key, None)
+                    if deferred is not None and self.keys.get(key) == deferred[0]:
+                        heapq.heappush(self.queue, (time.time(), deferred[0], key, deferred[1]))
+                        self.condition.notify()
@@ -69,6 +69,8 @@ class MainWindow(QMainWindow):
         self.logger = config_logger()
         # members definition
         self.com1 = None
+        self.read_buffer = bytearray(4096)
+        self.read_view = memoryview(self.read_buffer)
         self.cts1 = None
         self.rts1 = None
         self.com2 = None
@@ -162,12 +164,13 @@ class MainWindow(QMainWindow):
                                                             self.lineEdit_3, self.lineEdit_4))
 
     def read_port(self, port):
-        result = b''
-        r = port.read(1)
-        while r:
-            result += r
-            r = port.read(1)
-        return result
+        # drain available input through reusable buffer
+        result = bytearray()
+        n = port.readinto(self.read_buffer)
+        while n:
+            result += self.read_view[:n]
+            n = port.readinto(self.read_buffer)
+        return bytes(result)
 
     def timer_handler(self):
         if not self.connected: